@@ -27,3 +27,19 @@ resource "google_pubsub_topic_iam_member" "gmail_publisher" {
   role  = "roles/pubsub.publisher"
   member = "serviceAccount:gmail-api-push@system.gserviceaccount.com"
 }
+
+# 4. Renew the Gmail watch (expires after 7 days) from outside the service: when it
+#    scales to zero no instance runs the in-process renewal loop, and a lapsed watch
+#    sends no push that would start one
+resource "google_cloud_scheduler_job" "gmail_watch_renewal" {
+  name     = "gmail-watch-renewal"
+  schedule = "0 */6 * * *"
+
+  http_target {
+    http_method = "POST"
+    uri         = "https://your-service-url/renew-watch"
+    oidc_token {
+      service_account_email = var.push_auth_service_account
+    }
+  }
+}
@@ -0,0 +1,313 @@
+"""Replay Gmail history to recover OTPs missed during an outage.
+
+Pages through `history.list` from a history ID (or lists messages in a time
+range), fetches headers in Gmail batch requests, downloads only the body part of
+recent messages with bounded concurrency, and re-signals the newest OTP of each
+login workflow that is still running in Restate.
+
+Each OTP is signaled at most once per run. The run does not see what the live
+listener already delivered; a workflow that got its OTP but is still logging in
+is still pending, and Restate rejects resolving its OTP promise a second time.
+
+    uv run python -m api.backfill --mailbox me@example.com --start-history-id 123456 --dry-run
+    uv run python -m api.backfill --mailbox me@example.com \
+        --since 2026-10-19T09:00 --until 2026-10-19T10:00
+"""
+
+import argparse
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+
+from api.config import settings
+from api.gmail_fetch import STRUCTURE_FIELDS, fetch_message_body, message_headers
+from api.main import (
+    ParsedEmail,
+    existing_gmail_service,
+    extract_otp_email,
+    inbox_message_ids,
+    is_fresh,
+    latest_otp_per_workflow,
+    signal_otp_once,
+    workflow_client,
+    workflow_is_pending,
+    workflow_username,
+)
+from api.watch_manager import is_history_expired, mailbox_address, recovery_query
+
+# Gmail recommends at most 50 requests per batch
+MAX_BATCH_SIZE = 50
+
+_thread_local = threading.local()
+
+
+def _thread_service():
+    """Gmail clients are not thread-safe, so each worker thread gets its own."""
+    if not hasattr(_thread_local, "service"):
+        _thread_local.service = existing_gmail_service()
+    return _thread_local.service
+
+
+def chunked(message_ids: list[str], size: int) -> list[list[str]]:
+    """Split message IDs into consecutive batches of at most `size`."""
+    return [message_ids[i : i + size] for i in range(0, len(message_ids), size)]
+
+
+def list_history_message_ids(gmail_service, start_history_id: str) -> tuple[list[str], str]:
+    """Inbox messageAdded IDs since `start_history_id`, plus the latest history ID seen."""
+    message_ids: list[str] = []
+    latest_history_id = start_history_id
+    page_token = None
+    while True:
+        response = (
+            gmail_service.users()
+            .history()
+            .list(
+                userId="me",
+                startHistoryId=start_history_id,
+                historyTypes=["messageAdded"],
+                pageToken=page_token,
+            )
+            .execute()
+        )
+        message_ids.extend(inbox_message_ids(response.get("history", [])))
+        latest_history_id = response.get("historyId", latest_history_id)
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            break
+    # A message can appear in several history records
+    return list(dict.fromkeys(message_ids)), latest_history_id
+
+
+def list_range_message_ids(gmail_service, since: datetime, until: datetime | None) -> list[str]:
+    """All message IDs received in [since, until)."""
+    query = recovery_query(since.timestamp(), settings.GMAIL_OTP_SENDERS)
+    if until:
+        query += f" before:{int(until.timestamp())}"
+    print(f"🔎 Listing messages with query: {query}")
+
+    message_ids: list[str] = []
+    page_token = None
+    while True:
+        response = (
+            gmail_service.users()
+            .messages()
+            .list(userId="me", q=query, maxResults=500, pageToken=page_token)
+            .execute()
+        )
+        message_ids.extend(m["id"] for m in response.get("messages", []))
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            break
+    return message_ids
+
+
+def fetch_structures_batch(message_ids: list[str]) -> dict[str, dict]:
+    """Fetch headers + MIME structure for up to MAX_BATCH_SIZE messages in one HTTP call."""
+    gmail_service = _thread_service()
+    structures: dict[str, dict] = {}
+
+    def on_response(request_id, response, exception):
+        if exception is not None:
+            print(f"⚠️ Failed to fetch message {request_id}:", exception)
+            return
+        structures[request_id] = response
+
+    batch = gmail_service.new_batch_http_request(callback=on_response)
+    for msg_id in message_ids:
+        batch.add(
+            gmail_service.users()
+            .messages()
+            .get(userId="me", id=msg_id, format="full", fields=STRUCTURE_FIELDS),
+            request_id=msg_id,
+        )
+    batch.execute()
+    return structures
+
+
+def _date_header(structure: dict) -> str | None:
+    return next(iter(message_headers(structure.get("payload", {})).get("date", [])), None)
+
+
+def parse_structure(msg_id: str, structure: dict) -> ParsedEmail:
+    """Download the body part of one message and extract its OTP."""
+    message = fetch_message_body(
+        _thread_service(), msg_id, structure, max_body_bytes=settings.GMAIL_MAX_BODY_BYTES
+    )
+    parsed = extract_otp_email(
+        message.body,
+        message.headers.get("from", []),
+        message.headers.get("to", []),
+        _date_header(structure),
+    )
+    parsed.message_id = msg_id
+    return parsed
+
+
+async def signal_if_pending(mailbox: str, parsed: ParsedEmail, dry_run: bool, stats: dict) -> None:
+    """Signal the OTP if its workflow still waits for one; outcomes are counted in `stats`."""
+    username = workflow_username(parsed)
+    key = f"{parsed.platform}_{username}"
+    try:
+        if not await workflow_is_pending(parsed.platform, username):
+            print(f"⏭️ No pending workflow for {key} — skipping message {parsed.message_id}.")
+            stats["not_pending"] += 1
+            return
+        if dry_run:
+            print(f"🧪 [dry-run] Would signal {key} from message {parsed.message_id}")
+            return
+        # Claims the message and releases the claim if delivery fails
+        if await signal_otp_once(mailbox, parsed):
+            stats["signaled"] += 1
+    except Exception as e:
+        print(f"❌ Failed to signal {key} from message {parsed.message_id}:", e)
+        stats["signal_failed"] += 1
+
+
+async def backfill(
+    mailbox: str,
+    message_ids: list[str],
+    max_age: timedelta,
+    concurrency: int,
+    batch_size: int,
+    dry_run: bool,
+) -> dict:
+    stats = {
+        "messages": len(message_ids),
+        "fetched": 0,
+        "fetch_failed": 0,
+        "recent": 0,
+        "otps": 0,
+        "superseded": 0,
+        "not_pending": 0,
+        "signaled": 0,
+        "signal_failed": 0,
+    }
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.perf_counter()
+    otps: list[ParsedEmail] = []
+
+    async def process_batch(chunk: list[str]) -> None:
+        async with semaphore:
+            try:
+                structures = await asyncio.to_thread(fetch_structures_batch, chunk)
+            except Exception as e:
+                print(f"⚠️ Failed to fetch a batch of {len(chunk)} message(s):", e)
+                stats["fetch_failed"] += len(chunk)
+                return
+        stats["fetched"] += len(structures)
+
+        # Skip body downloads for messages too old to match a pending workflow
+        recent = {
+            msg_id: structure
+            for msg_id, structure in structures.items()
+            if is_fresh(_date_header(structure), max_age=max_age)
+        }
+        stats["recent"] += len(recent)
+        await asyncio.gather(*(parse_message(m, s) for m, s in recent.items()))
+
+    async def parse_message(msg_id: str, structure: dict) -> None:
+        async with semaphore:
+            try:
+                parsed = await asyncio.to_thread(parse_structure, msg_id, structure)
+            except Exception as e:
+                print(f"⚠️ Failed to parse message {msg_id}:", e)
+                return
+        if parsed.otp:
+            otps.append(parsed)
+
+    try:
+        await asyncio.gather(*(process_batch(chunk) for chunk in chunked(message_ids, batch_size)))
+        # Parse everything first: a resend invalidates earlier codes, so each workflow
+        # gets only its newest OTP, signaled once
+        latest = latest_otp_per_workflow(otps)
+        stats["otps"] = len(otps)
+        stats["superseded"] = len(otps) - len(latest)
+        await asyncio.gather(
+            *(signal_if_pending(mailbox, parsed, dry_run, stats) for parsed in latest)
+        )
+    finally:
+        await workflow_client().aclose()
+
+    elapsed = time.perf_counter() - start
+    stats["elapsed_s"] = round(elapsed, 2)
+    stats["messages_per_s"] = round(stats["fetched"] / elapsed, 1) if elapsed else 0.0
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay Gmail history and re-signal missed OTPs.")
+    parser.add_argument(
+        "--mailbox", required=True, help="Email address of the authenticated mailbox"
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--start-history-id", help="Replay history.list from this history ID")
+    source.add_argument("--since", type=datetime.fromisoformat, help="Start of time range (ISO)")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="End of time range (ISO)")
+    parser.add_argument(
+        "--max-age-minutes",
+        type=int,
+        default=15,
+        help="Only parse messages younger than this; older OTPs cannot match a pending workflow",
+    )
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent Gmail requests")
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Parse and check workflow status but do not signal",
+    )
+    parser.epilog = (
+        "OTPs are signaled at most once per run, and only to workflows Restate reports as "
+        "still running; OTPs the live listener already delivered are not tracked."
+    )
+    args = parser.parse_args()
+
+    if args.until and not args.since:
+        parser.error("--until requires --since")
+    if not 1 <= args.batch_size <= MAX_BATCH_SIZE:
+        parser.error(f"--batch-size must be between 1 and {MAX_BATCH_SIZE}")
+
+    gmail_service = existing_gmail_service()
+    authenticated = mailbox_address(gmail_service)
+    if authenticated.lower() != args.mailbox.lower():
+        parser.error(f"token is for {authenticated}, not {args.mailbox}")
+
+    list_start = time.perf_counter()
+    if args.start_history_id:
+        try:
+            message_ids, latest_history_id = list_history_message_ids(
+                gmail_service, args.start_history_id
+            )
+        except Exception as e:
+            if not is_history_expired(e):
+                raise
+            parser.error(
+                f"history ID {args.start_history_id} is older than Gmail retains; "
+                "replay a time range with --since/--until instead"
+            )
+        print(
+            f"📜 History {args.start_history_id} → {latest_history_id}: "
+            f"{len(message_ids)} message(s)"
+        )
+    else:
+        message_ids = list_range_message_ids(gmail_service, args.since, args.until)
+        print(f"📜 Time range: {len(message_ids)} message(s)")
+    print(f"⏱️ Listed in {time.perf_counter() - list_start:.2f}s")
+
+    stats = asyncio.run(
+        backfill(
+            mailbox=args.mailbox,
+            message_ids=message_ids,
+            max_age=timedelta(minutes=args.max_age_minutes),
+            concurrency=args.concurrency,
+            batch_size=args.batch_size,
+            dry_run=args.dry_run,
+        )
+    )
+    print("📊 Backfill complete:", stats)
+
+
+if __name__ == "__main__":
+    main()
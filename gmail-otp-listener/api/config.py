@@ -25,6 +25,34 @@ class Settings(BaseSettings):
     PORT: int
     GMAIL_TOPIC_NAME: str
 
+    # "minimal" fetches headers + the HTML/text body part only; "raw" downloads the full MIME
+    GMAIL_FETCH_FORMAT: Literal["minimal", "raw"] = Field(default="minimal")
+    GMAIL_MAX_BODY_BYTES: int = Field(default=512_000)
+
+    # Parse results per (mailbox, message ID), shared by overlapping Pub/Sub notifications
+    MESSAGE_CACHE_SIZE: int = Field(default=1024)
+    MESSAGE_CACHE_TTL_SECONDS: int = Field(default=600)
+
+    # Pre-load lazy imports and clients in the app lifespan, before /ready reports ready
+    WARM_UP_ON_STARTUP: bool = Field(default=True)
+
+    # Gmail watch lifecycle and history cursor
+    # Per-mailbox history cursor and watch expiry live in WATCH_STATE_FILE; the global
+    # HISTORY_ID_FILE is only read as a fallback until a mailbox has its own cursor.
+    # On a scale-to-zero deployment put WATCH_STATE_FILE on storage that outlives the
+    # instance (e.g. a mounted bucket), and have a scheduler call POST /renew-watch:
+    # the in-process renewal loop only runs while an instance is up
+    HISTORY_ID_FILE: str = Field(default="last_history_id.txt")
+    WATCH_STATE_FILE: str = Field(default="watch_state.json")
+    WATCH_RENEWAL_ENABLED: bool = Field(default=True)
+    WATCH_CHECK_INTERVAL_SECONDS: int = Field(default=3600)
+    WATCH_RENEW_BEFORE_SECONDS: int = Field(default=24 * 3600)
+
+    # Bounded messages.list recovery when history.list reports an expired startHistoryId;
+    # the time window is capped at the OTP freshness window
+    HISTORY_RECOVERY_MAX_MESSAGES: int = Field(default=50)
+    GMAIL_OTP_SENDERS: list[str] = Field(default_factory=list)
+
     @field_validator("POSTGRES_URI", mode="after")
     @classmethod
     def validate_db_uri(cls, _, info: ValidationInfo):
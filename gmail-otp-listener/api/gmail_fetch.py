@@ -0,0 +1,163 @@
+import base64
+from email.message import Message
+
+from pydantic import BaseModel
+
+# Deepest MIME nesting we ask Gmail to describe (mixed > related > alternative > html + forwards)
+MAX_PART_DEPTH = 5
+
+BODY_MIME_TYPES = ["text/html", "text/plain"]
+
+
+class MessageBody(BaseModel):
+    headers: dict[str, list[str]]
+    mime_type: str | None = None
+    body: str = ""
+
+
+def _part_fields(depth: int, leaf: str) -> str:
+    """Build a nested `parts(...)` fields mask `depth` levels deep."""
+    if depth == 0:
+        return leaf
+    return f"{leaf},parts({_part_fields(depth - 1, leaf)})"
+
+
+# Structure only: headers (for each part's charset too), MIME tree and part sizes, no body data
+STRUCTURE_FIELDS = (
+    "id,payload("
+    + _part_fields(MAX_PART_DEPTH, "partId,mimeType,filename,headers,body(size,attachmentId)")
+    + ")"
+)
+
+
+def _data_fields(depth: int) -> str:
+    """Fields mask returning body data only for parts at exactly `depth`."""
+    mask = "partId,body/data"
+    for _ in range(depth):
+        mask = f"parts({mask})"
+    return f"payload({mask})"
+
+
+def message_headers(payload: dict) -> dict[str, list[str]]:
+    """Index payload headers by lower-cased name."""
+    headers: dict[str, list[str]] = {}
+    for header in payload.get("headers", []):
+        headers.setdefault(header["name"].lower(), []).append(header["value"])
+    return headers
+
+
+def _find_part(payload: dict, mime_type: str, depth: int = 0) -> tuple[dict, int] | None:
+    """Depth-first search for the first part with `mime_type`, skipping attachments."""
+    if payload.get("mimeType") == mime_type and not payload.get("filename"):
+        return payload, depth
+    for part in payload.get("parts", []):
+        found = _find_part(part, mime_type, depth + 1)
+        if found:
+            return found
+    return None
+
+
+def _inline_size_at_depth(payload: dict, depth: int) -> int:
+    """Bytes `_data_fields(depth)` downloads: every inline part at `depth`, not just one."""
+    if depth == 0:
+        body = payload.get("body", {})
+        return 0 if body.get("attachmentId") else body.get("size", 0)
+    return sum(_inline_size_at_depth(part, depth - 1) for part in payload.get("parts", []))
+
+
+def _find_by_part_id(payload: dict, part_id: str) -> dict | None:
+    if payload.get("partId", "") == part_id:
+        return payload
+    for part in payload.get("parts", []):
+        found = _find_by_part_id(part, part_id)
+        if found:
+            return found
+    return None
+
+
+def _part_charset(part: dict) -> str:
+    """Charset declared in the part's Content-Type header, UTF-8 if none."""
+    content_type = next(iter(message_headers(part).get("content-type", [])), None)
+    if not content_type:
+        return "utf-8"
+    msg = Message()
+    msg["Content-Type"] = content_type
+    return msg.get_content_charset("utf-8")
+
+
+def _decode(data: str, charset: str = "utf-8") -> str:
+    raw = base64.urlsafe_b64decode(data.encode("ASCII"))
+    try:
+        return raw.decode(charset, errors="replace")
+    except LookupError:
+        return raw.decode("utf-8", errors="replace")
+
+
+def fetch_message_headers(gmail_service, msg_id: str) -> dict:
+    """Fetch the message structure (headers + MIME tree) without any body data."""
+    return (
+        gmail_service.users()
+        .messages()
+        .get(userId="me", id=msg_id, format="full", fields=STRUCTURE_FIELDS)
+        .execute()
+    )
+
+
+def fetch_message_body(
+    gmail_service, msg_id: str, structure: dict, max_body_bytes: int
+) -> MessageBody:
+    """Download only the HTML (or plain text) body part of a message.
+
+    `structure` is the result of `fetch_message_headers`. Bodies larger than
+    `max_body_bytes` are not downloaded and yield an empty body; for an inline
+    part the limit covers every part Gmail returns alongside it.
+    """
+    payload = structure.get("payload", {})
+    headers = message_headers(payload)
+
+    for mime_type in BODY_MIME_TYPES:
+        found = _find_part(payload, mime_type)
+        if found:
+            break
+    else:
+        print(f"📭 No text body part in message {msg_id}.")
+        return MessageBody(headers=headers)
+
+    part, depth = found
+    size = part.get("body", {}).get("size", 0)
+    if size > max_body_bytes:
+        print(f"⚠️ Body part of {msg_id} is {size} bytes (limit {max_body_bytes}) — skipping.")
+        return MessageBody(headers=headers, mime_type=mime_type)
+
+    attachment_id = part.get("body", {}).get("attachmentId")
+    if attachment_id:
+        # Gmail moves large bodies out of line; fetch just that blob
+        blob = (
+            gmail_service.users()
+            .messages()
+            .attachments()
+            .get(userId="me", messageId=msg_id, id=attachment_id)
+            .execute()
+        )
+        data = blob.get("data", "")
+    else:
+        # Inline body: Gmail returns data for every part at this depth (e.g. the
+        # text/plain sibling of the HTML part), so all of it counts against the limit
+        inline_size = _inline_size_at_depth(payload, depth)
+        if inline_size > max_body_bytes:
+            print(
+                f"⚠️ Inline parts of {msg_id} total {inline_size} bytes "
+                f"(limit {max_body_bytes}) — skipping."
+            )
+            return MessageBody(headers=headers, mime_type=mime_type)
+        response = (
+            gmail_service.users()
+            .messages()
+            .get(userId="me", id=msg_id, format="full", fields=_data_fields(depth))
+            .execute()
+        )
+        data_part = _find_by_part_id(response.get("payload", {}), part.get("partId", ""))
+        data = (data_part or {}).get("body", {}).get("data", "")
+
+    body = _decode(data, _part_charset(part)) if data else ""
+    return MessageBody(headers=headers, mime_type=mime_type, body=body)
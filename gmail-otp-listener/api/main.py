@@ -1,25 +1,44 @@
+import asyncio
 import base64
 import json
 import os
 import re
+import threading
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from email import policy
 from email.parser import BytesParser
 from email.utils import getaddresses, parsedate_to_datetime
+from functools import lru_cache
+from typing import TYPE_CHECKING
 
-import httpx
 import restate
-from bs4 import BeautifulSoup
 from fastapi import FastAPI, Header, Request
-from google.auth.transport.requests import Request as RefreshRequest
+from fastapi.responses import JSONResponse
 from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from pydantic import BaseModel
 
 # from restate import client as restate_client
 from api.config import settings
+from api.gmail_fetch import fetch_message_body, fetch_message_headers, message_headers
 from api.login_workflow import login_wf
+from api.message_cache import MessageCache
+from api.watch_manager import (
+    is_history_expired,
+    load_history_id,
+    mailbox_address,
+    recover_history_gap,
+    renew_watch_if_due,
+    run_watch_renewal,
+    save_history_id,
+    start_watch,
+)
+
+# Off the cold-start path: googleapiclient, bs4, httpx, google.auth's requests transport
+# and the OAuth flow are imported lazily (and pre-loaded by `warm_up` before traffic arrives).
+if TYPE_CHECKING:
+    import httpx
 
 restate_app = restate.app(
     services=[
@@ -30,11 +49,32 @@ restate_app = restate.app(
 )
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _ready
+    if settings.WARM_UP_ON_STARTUP:
+        warm_up()
+    renewal_task = None
+    # The renewal loop only uses the stored token; it never triggers the OAuth flow
+    if settings.WATCH_RENEWAL_ENABLED:
+        renewal_task = asyncio.create_task(run_watch_renewal(existing_gmail_service))
+    # Ready once startup finished, warmed up or not; without warm-up the first request is cold
+    _ready = True
+    yield
+    if renewal_task is not None:
+        renewal_task.cancel()
+    if _workflow_client is not None:
+        await _workflow_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 app.mount("/restate", restate_app)
 
 SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
 
+# Emails older than this cannot carry an OTP the login workflow still waits for
+OTP_MAX_AGE = timedelta(minutes=2)
+
 
 class PubSubMessage(BaseModel):
     message: dict
@@ -46,66 +86,177 @@ class ParsedEmail(BaseModel):
     to_email: str
     otp: str | None = None
     platform: str | None = None
+    message_id: str | None = None
+    sent_at: datetime | None = None
+
+
+class SignalSummary(BaseModel):
+    signaled: int = 0
+    rejected: int = 0
+    retryable: int = 0
+
+
+message_cache: MessageCache[ParsedEmail] = MessageCache(
+    max_size=settings.MESSAGE_CACHE_SIZE, ttl_seconds=settings.MESSAGE_CACHE_TTL_SECONDS
+)
+
+
+# Messages being fetched right now, so overlapping pushes for the same ID fetch it once
+_in_flight: dict[tuple[str, str], threading.Event] = {}
+_in_flight_lock = threading.Lock()
+IN_FLIGHT_WAIT_SECONDS = 30
+
+_credentials: Credentials | None = None
+_workflow_client: "httpx.AsyncClient | None" = None
+_ready = False
 
 
 def get_credentials():
-    creds = None
+    """Return Gmail credentials, starting the interactive OAuth flow if none are stored."""
+    global _credentials
+    creds = load_existing_credentials()
+    if creds is None:
+        creds = _run_oauth_flow()
+        _credentials = creds
+    return creds
+
+
+def load_existing_credentials() -> Credentials | None:
+    """Load (and refresh) the stored token without ever starting the OAuth flow.
 
-    if os.path.exists(settings.TOKEN_FILE):
+    Returns None when no usable token is stored; refresh errors are raised.
+    """
+    global _credentials
+    if _credentials and _credentials.valid:
+        return _credentials
+
+    if not os.path.exists(settings.TOKEN_FILE):
+        return None
+    try:
         with open(settings.TOKEN_FILE) as f:
             creds_data = json.load(f)
             print("✅ Token file found.")
-        try:
-            creds = Credentials.from_authorized_user_info(creds_data, SCOPES)
-            print("✅ Credentials loaded from token file.")
-        except ValueError:
-            print("⚠️ Failed to load credentials from file.")
-            creds = None
+        creds = Credentials.from_authorized_user_info(creds_data, SCOPES)
+        print("✅ Credentials loaded from token file.")
+    except ValueError:
+        print("⚠️ Failed to load credentials from file.")
+        return None
 
     # 🔄 Refresh token if available and token is expired
-    if creds and creds.expired and creds.refresh_token:
+    if creds.expired and creds.refresh_token:
         print("🔄 Token expired, refreshing...")
+        from google.auth.transport.requests import Request as RefreshRequest
+
         creds.refresh(RefreshRequest())
         with open(settings.TOKEN_FILE, "w") as token_file:
             token_file.write(creds.to_json())
         print("✅ Token refreshed and saved.")
-        return creds
 
-    # ❌ If no creds or no refresh_token, re-authenticate
-    if not creds or not creds.valid:
-        print("⚠️ No valid credentials, initiating flow...")
-        flow = InstalledAppFlow.from_client_secrets_file(
-            settings.CLIENT_SECRET_FILE, SCOPES, redirect_uri=settings.REDIRECT_URI
-        )
-        creds = flow.run_local_server(port=settings.PORT, access_type="offline", prompt="consent")
-        print("✅ New token obtained.")
-        with open(settings.TOKEN_FILE, "w") as token_file:
-            token_file.write(creds.to_json())
-        return creds
+    if not creds.valid:
+        return None
+    _credentials = creds
+    return creds
+
+
+def _run_oauth_flow() -> Credentials:
+    # ❌ No usable stored token, re-authenticate interactively
+    print("⚠️ No valid credentials, initiating flow...")
+    from google_auth_oauthlib.flow import InstalledAppFlow
 
+    flow = InstalledAppFlow.from_client_secrets_file(
+        settings.CLIENT_SECRET_FILE, SCOPES, redirect_uri=settings.REDIRECT_URI
+    )
+    creds = flow.run_local_server(port=settings.PORT, access_type="offline", prompt="consent")
+    print("✅ New token obtained.")
+    with open(settings.TOKEN_FILE, "w") as token_file:
+        token_file.write(creds.to_json())
     return creds
 
 
-def parse_email(raw_email: bytes) -> ParsedEmail | None:
-    """Parse email and extract OTP using BeautifulSoup + regex."""
-    msg = BytesParser(policy=policy.default).parsebytes(raw_email)
+@lru_cache(maxsize=1)
+def gmail_discovery_document() -> dict:
+    """Gmail v1 discovery document bundled with google-api-python-client, parsed once."""
+    from googleapiclient.discovery_cache import get_static_doc
 
-    # Check email freshness
-    date_header = msg["Date"]
-    email_datetime = parsedate_to_datetime(date_header)
-    if datetime.now(email_datetime.tzinfo) - email_datetime > timedelta(minutes=2):
-        return None
+    return json.loads(get_static_doc("gmail", "v1"))
 
-    # Extract body (prefer HTML)
-    body = ""
-    if msg.is_multipart():
-        for part in msg.walk():
-            if part.get_content_type() == "text/html":
-                body = part.get_content()
-                break
-    else:
-        if msg.get_content_type() == "text/html":
-            body = msg.get_content()
+
+def build_gmail_service(creds):
+    """Build a Gmail client from the static discovery document (no discovery HTTP call)."""
+    from googleapiclient.discovery import build_from_document
+
+    return build_from_document(gmail_discovery_document(), credentials=creds)
+
+
+def existing_gmail_service():
+    """Gmail client from the stored token, for startup, background and CLI use.
+
+    Never interactive: raises instead of starting the OAuth flow.
+    """
+    creds = load_existing_credentials()
+    if creds is None:
+        raise RuntimeError("No usable Gmail token stored; call /authenticate-user first")
+    return build_gmail_service(creds)
+
+
+def workflow_client() -> "httpx.AsyncClient":
+    """Shared HTTP client for signaling Restate workflows."""
+    global _workflow_client
+    if _workflow_client is None:
+        import httpx
+
+        _workflow_client = httpx.AsyncClient()
+    return _workflow_client
+
+
+def warm_up() -> dict:
+    """Pre-load lazy modules and pre-create clients so the first webhook is not cold."""
+    global _ready
+    timings = {}
+
+    start = time.perf_counter()
+    gmail_discovery_document()
+    timings["discovery_document_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+    start = time.perf_counter()
+    from bs4 import BeautifulSoup
+
+    BeautifulSoup("", "html.parser")
+    timings["html_parser_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+    # Only load existing tokens — never start the interactive OAuth flow at startup
+    start = time.perf_counter()
+    try:
+        existing_gmail_service()
+    except Exception as e:
+        print("⚠️ Warm-up could not prepare Gmail client:", e)
+    timings["gmail_client_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+    start = time.perf_counter()
+    workflow_client()
+    timings["workflow_client_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+    _ready = True
+    print("🔥 Warm-up complete:", timings)
+    return timings
+
+
+def is_fresh(date_header: str | None, max_age: timedelta = OTP_MAX_AGE) -> bool:
+    """True if the email was sent within `max_age` (2 minutes by default)."""
+    if not date_header:
+        return False
+    return is_recent(parsedate_to_datetime(date_header), max_age)
+
+
+def is_recent(sent_at: datetime, max_age: timedelta = OTP_MAX_AGE) -> bool:
+    return datetime.now(sent_at.tzinfo) - sent_at <= max_age
+
+
+def extract_otp_email(
+    body: str, from_headers: list[str], to_headers: list[str], date_header: str | None = None
+) -> ParsedEmail:
+    """Extract From/To and OTP from an HTML (or plain text) body."""
+    from bs4 import BeautifulSoup
 
     soup = BeautifulSoup(body, "html.parser")
     text = soup.get_text()
@@ -118,13 +269,11 @@ def parse_email(raw_email: bytes) -> ParsedEmail | None:
 
     # === STEP 2: If missing, fall back to headers ===
     if not real_from:
-        email_from_header = msg.get_all("From", [])
-        parsed_from = getaddresses(email_from_header)
+        parsed_from = getaddresses(from_headers)
         real_from = parsed_from[0][1] if parsed_from else None
 
     if not real_to:
-        email_to_header = msg.get_all("To", [])
-        parsed_to = getaddresses(email_to_header)
+        parsed_to = getaddresses(to_headers)
         real_to = parsed_to[0][1] if parsed_to else None
 
     # Extract OTP (4-digit number)
@@ -133,49 +282,116 @@ def parse_email(raw_email: bytes) -> ParsedEmail | None:
 
     platform = "zepto"
 
-    return ParsedEmail(from_email=real_from, to_email=real_to, otp=otp, platform=platform)
+    sent_at = parsedate_to_datetime(date_header) if date_header else None
 
+    return ParsedEmail(
+        from_email=real_from, to_email=real_to, otp=otp, platform=platform, sent_at=sent_at
+    )
 
-def fetch_latest_email() -> ParsedEmail | None:
-    print("📭 Fallback: Fetching latest email manually.")
 
-    try:
-        creds = get_credentials()
-        gmail_service = build("gmail", "v1", credentials=creds)
+def parse_email(raw_email: bytes) -> ParsedEmail | None:
+    """Parse email and extract OTP using BeautifulSoup + regex."""
+    msg = BytesParser(policy=policy.default).parsebytes(raw_email)
 
-        results = (
-            gmail_service.users()
-            .messages()
-            .list(userId="me", labelIds=["INBOX"], maxResults=1)
-            .execute()
-        )
+    # Check email freshness
+    if not is_fresh(msg["Date"]):
+        return None
+
+    # Extract body (prefer HTML)
+    body = ""
+    if msg.is_multipart():
+        for part in msg.walk():
+            if part.get_content_type() == "text/html":
+                body = part.get_content()
+                break
+    else:
+        if msg.get_content_type() == "text/html":
+            body = msg.get_content()
+
+    return extract_otp_email(body, msg.get_all("From", []), msg.get_all("To", []), msg["Date"])
+
+
+def fetch_parsed_email(gmail_service, msg_id: str, mailbox: str = "me") -> ParsedEmail | None:
+    """Fetch and parse a message, served from `message_cache` when seen before.
+
+    If another push is already fetching the same message, wait for its result
+    instead of fetching it a second time.
+    """
+    sentinel = object()
+    cached = message_cache.get(mailbox, msg_id, default=sentinel)
+    if cached is not sentinel:
+        print(f"♻️ Message {msg_id} served from cache.")
+        return cached  # type: ignore[return-value]
+
+    key = (mailbox, msg_id)
+    with _in_flight_lock:
+        fetching = _in_flight.get(key)
+        if fetching is None:
+            _in_flight[key] = threading.Event()
+    if fetching is not None:
+        fetching.wait(IN_FLIGHT_WAIT_SECONDS)
+        cached = message_cache.get(mailbox, msg_id, default=sentinel)
+        if cached is not sentinel:
+            print(f"♻️ Message {msg_id} served from a concurrent fetch.")
+            return cached  # type: ignore[return-value]
+        # The other fetch failed or is stuck: fetch it ourselves
+        return _fetch_and_cache(gmail_service, mailbox, msg_id)
+
+    try:
+        return _fetch_and_cache(gmail_service, mailbox, msg_id)
+    finally:
+        with _in_flight_lock:
+            _in_flight.pop(key).set()
 
-        messages = results.get("messages", [])
-        print(f"📨 Messages found in inbox: {len(messages)}")
 
-        if not messages:
-            print("📭 No messages found.")
-            return None
+def _fetch_and_cache(gmail_service, mailbox: str, msg_id: str) -> ParsedEmail | None:
+    parsed = _fetch_and_parse(gmail_service, msg_id)
+    if parsed is not None:
+        parsed.message_id = msg_id
+    message_cache.put(mailbox, msg_id, parsed)
+    return parsed
 
-        msg_id = messages[0]["id"]
-        print(f"🔍 Fetching message ID: {msg_id}")
 
+def _fetch_and_parse(gmail_service, msg_id: str) -> ParsedEmail | None:
+    """Fetch a single message and parse it, honouring `GMAIL_FETCH_FORMAT`."""
+    if settings.GMAIL_FETCH_FORMAT == "raw":
         full_msg = (
             gmail_service.users().messages().get(userId="me", id=msg_id, format="raw").execute()
         )
-
         raw_msg = base64.urlsafe_b64decode(full_msg["raw"].encode("ASCII"))
-        parsed_result = parse_email(raw_msg)
-        if parsed_result is None:
-            print("📭 Email is older than 5 minutes or not from a valid platform.")
-            return None
-        print("📨 Parsed Email:", parsed_result.dict())
-        return parsed_result
+        return parse_email(raw_msg)
 
-    except Exception as e:
-        print("❌ Error while fetching latest email:", e)
+    # Minimal: headers + MIME structure first, then only the body part we need
+    structure = fetch_message_headers(gmail_service, msg_id)
+    headers = message_headers(structure.get("payload", {}))
+    date_header = next(iter(headers.get("date", [])), None)
+    if not is_fresh(date_header):
         return None
 
+    message = fetch_message_body(
+        gmail_service, msg_id, structure, max_body_bytes=settings.GMAIL_MAX_BODY_BYTES
+    )
+    return extract_otp_email(
+        message.body, message.headers.get("from", []), message.headers.get("to", []), date_header
+    )
+
+
+def parse_messages(gmail_service, mailbox: str, msg_ids: list[str]) -> list[ParsedEmail]:
+    """Parse each message, fetching only IDs that miss `message_cache`.
+
+    A message that cannot be fetched is logged and skipped so it never blocks the cursor.
+    """
+    parsed_emails = []
+    for msg_id in msg_ids:
+        try:
+            parsed_email = fetch_parsed_email(gmail_service, msg_id, mailbox=mailbox)
+        except Exception as e:
+            print(f"⚠️ Failed to fetch message {msg_id}:", e)
+            continue
+        if parsed_email is not None:
+            parsed_emails.append(parsed_email)
+    return parsed_emails
+
 
 async def signal_workflow_with_otp(platform: str, username: str, otp: str):
     """Signal the workflow with the received OTP"""
@@ -184,14 +400,143 @@ async def signal_workflow_with_otp(platform: str, username: str, otp: str):
 
     print("✅ Signaling workflow with OTP...")
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"http://localhost:8080/login_workflow/{key}/receive_otp",
-            json={"otp": otp},
-            headers={"Content-Type": "application/json"},
+    response = await workflow_client().post(
+        f"http://localhost:8080/login_workflow/{key}/receive_otp",
+        json={"otp": otp},
+        headers={"Content-Type": "application/json"},
+    )
+    print("✅ Workflow signaled with OTP.")
+    return response
+
+
+async def workflow_is_pending(platform: str, username: str) -> bool:
+    """True if the login workflow for this user is running and has not completed.
+
+    Restate's ingress answers `/output` with 470 while a workflow is still running,
+    with its result once it completed, and with 404 if it was never started.
+    """
+    key = f"{platform}_{username}"
+    response = await workflow_client().get(
+        f"http://localhost:8080/restate/workflow/login_workflow/{key}/output"
+    )
+    return response.status_code == 470
+
+
+def is_retryable_signal_error(error: Exception) -> bool:
+    """Connection errors and 5xx may succeed later; a 4xx means Restate rejected the OTP.
+
+    Resolving a workflow's OTP promise a second time (e.g. for a "resend OTP" email
+    after the first code was delivered) is such a rejection and never succeeds.
+    """
+    import httpx
+
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+def workflow_username(parsed_email: ParsedEmail) -> str:
+    return parsed_email.to_email.split("@")[0]
+
+
+def latest_otp_per_workflow(parsed_emails: list[ParsedEmail]) -> list[ParsedEmail]:
+    """Keep only the newest OTP per workflow key; a resend invalidates earlier codes.
+
+    Emails are ordered by their Date header, falling back to list order (history
+    order, oldest first) when it is missing.
+    """
+    latest: dict[tuple[str | None, str], ParsedEmail] = {}
+    for parsed_email in parsed_emails:
+        if not parsed_email.otp:
+            continue
+        key = (parsed_email.platform, workflow_username(parsed_email))
+        current = latest.get(key)
+        if current is None or _sent_timestamp(parsed_email) >= _sent_timestamp(current):
+            latest[key] = parsed_email
+    return list(latest.values())
+
+
+def _sent_timestamp(parsed_email: ParsedEmail) -> float:
+    return parsed_email.sent_at.timestamp() if parsed_email.sent_at else float("-inf")
+
+
+async def signal_otp_once(mailbox: str, parsed_email: ParsedEmail) -> bool:
+    """Signal the workflow unless this message's OTP was already delivered.
+
+    The message is claimed before the POST so concurrent notifications do not both
+    signal it. The claim is released if delivery fails with a retryable error and
+    kept if Restate rejected the OTP; either way the error is re-raised.
+    """
+    if not message_cache.mark_signaled(mailbox, parsed_email.message_id):
+        print(f"⏭️ OTP from message {parsed_email.message_id} already signaled — skipping.")
+        return False
+    print("✅ Parsed email has OTP. Signaling workflow...")
+    try:
+        response = await signal_workflow_with_otp(
+            platform=parsed_email.platform,
+            username=workflow_username(parsed_email),
+            otp=parsed_email.otp,
         )
-        print("✅ Workflow signaled with OTP.")
-        return response
+        response.raise_for_status()
+    except Exception as e:
+        if is_retryable_signal_error(e):
+            message_cache.clear_signaled(mailbox, parsed_email.message_id)
+        raise
+    return True
+
+
+async def signal_otps(mailbox: str, parsed_emails: list[ParsedEmail]) -> SignalSummary:
+    """Signal the newest fresh OTP of each workflow, attempting all of them.
+
+    A failure never stops later OTPs from being signaled; the summary tells the
+    caller whether any failure is worth retrying.
+    """
+    summary = SignalSummary()
+    for parsed_email in latest_otp_per_workflow(parsed_emails):
+        # A cached OTP stops being retried once the workflow can no longer use it
+        if parsed_email.sent_at and not is_recent(parsed_email.sent_at):
+            print(f"⌛ OTP from message {parsed_email.message_id} expired — dropping.")
+            continue
+        try:
+            summary.signaled += await signal_otp_once(mailbox, parsed_email)
+        except Exception as e:
+            if is_retryable_signal_error(e):
+                print(f"⚠️ Signaling message {parsed_email.message_id} failed, will retry:", e)
+                summary.retryable += 1
+            else:
+                print(f"❌ Restate rejected OTP from message {parsed_email.message_id}:", e)
+                summary.rejected += 1
+    return summary
+
+
+def inbox_message_ids(history: list[dict]) -> list[str]:
+    """IDs of messages added to the inbox, each once even if in several history records.
+
+    Sent mail and drafts also show up as messageAdded; they never carry an OTP.
+    """
+    return list(
+        dict.fromkeys(
+            m["message"]["id"]
+            for h in history
+            for m in h.get("messagesAdded", [])
+            if "INBOX" in m["message"].get("labelIds", ["INBOX"])
+        )
+    )
+
+
+async def recover_expired_history(gmail_service, mailbox: str, history_id: str) -> dict:
+    """🕳️ Cursor older than Gmail's history retention: scan only the gap, then reset it."""
+    message_ids = await asyncio.to_thread(recover_history_gap, gmail_service, mailbox, OTP_MAX_AGE)
+    parsed_emails = await asyncio.to_thread(parse_messages, gmail_service, mailbox, message_ids)
+    summary = await signal_otps(mailbox, parsed_emails)
+    if summary.retryable:
+        return {"status": "signal-retry", **summary.model_dump()}
+    save_history_id(mailbox, history_id)
+    return {
+        "status": "recovered-history",
+        "messages": len(message_ids),
+        "signaled": summary.signaled,
+    }
 
 
 @app.post("/authenticate-user", response_model=None)
@@ -214,24 +559,52 @@ def oauth2callback(request: Request):
     return {"status": "Received code", "code": code}
 
 
+@app.get("/ready")
+def readiness():
+    if not _ready:
+        return JSONResponse(status_code=503, content={"status": "warming-up"})
+    return {"status": "ready"}
+
+
+@app.post("/warm-up")
+def warm_up_endpoint():
+    return {"status": "warm", "timings_ms": warm_up()}
+
+
+@app.get("/message-cache")
+def message_cache_stats():
+    return message_cache.stats()
+
+
 @app.post("/setup-watch")
 def setup_gmail_watch():
     try:
         creds = get_credentials()
-        service = build("gmail", "v1", credentials=creds)
-
-        request_body = {
-            "labelIds": ["UNREAD"],
-            "topicName": settings.GMAIL_TOPIC_NAME,
-        }
-
-        response = service.users().watch(userId="me", body=request_body).execute()
+        service = build_gmail_service(creds)
+        response = start_watch(service, mailbox_address(service))
 
     except Exception as e:
         return {"error": str(e)}
     return {"status": "Watch set", "response": response}
 
 
+@app.post("/renew-watch")
+def renew_gmail_watch():
+    """Renew the watch if it is close to expiry; called by an external scheduler.
+
+    Answers 500 on failure so the scheduler retries.
+    """
+    try:
+        service = existing_gmail_service()
+        response = renew_watch_if_due(service, mailbox_address(service))
+    except Exception as e:
+        print("❌ Error renewing Gmail watch:", e)
+        return JSONResponse(status_code=500, content={"error": str(e)})
+    if response is None:
+        return {"status": "Watch still valid"}
+    return {"status": "Watch renewed", "response": response}
+
+
 @app.post("/gmail-webhook")
 async def gmail_webhook(request: Request, x_cloud_trace_context: str = Header(None)):
     try:
@@ -251,20 +624,18 @@ async def gmail_webhook(request: Request, x_cloud_trace_context: str = Header(No
         if not history_id:
             return {"status": "no-history-id"}
 
-        creds = get_credentials()
-        gmail_service = build("gmail", "v1", credentials=creds)
+        # Never start the interactive OAuth flow inside the event loop; without a
+        # stored token this fails and is reported below
+        gmail_service = existing_gmail_service()
+        mailbox = email_address or "me"
 
-        # Load last known history ID from file
-        last_id_file = "last_history_id.txt"
-        if not os.path.exists(last_id_file):
-            with open(last_id_file, "w") as f:
-                f.write(str(history_id))
+        # Load last known history ID for this mailbox
+        last_history_id = load_history_id(mailbox)
+        if last_history_id is None:
+            save_history_id(mailbox, history_id)
             print("🔐 First-time setup, saving initial history ID.")
             return {"status": "initialized-history"}
 
-        with open(last_id_file) as f:
-            last_history_id = f.read().strip()
-
         # 🚫 Skip if incoming historyId is older or same
         if int(history_id) <= int(last_history_id):
             print(
@@ -275,38 +646,41 @@ async def gmail_webhook(request: Request, x_cloud_trace_context: str = Header(No
         print("🔄 Checking Gmail history from", last_history_id, "to", history_id)
 
         # Fetch messageAdded events
-        history_response = (
-            gmail_service.users()
-            .history()
-            .list(
-                userId="me",
-                startHistoryId=last_history_id,
-                historyTypes=["messageAdded"],
+        try:
+            history_response = (
+                gmail_service.users()
+                .history()
+                .list(
+                    userId="me",
+                    startHistoryId=last_history_id,
+                    historyTypes=["messageAdded"],
+                )
+                .execute()
             )
-            .execute()
-        )
-
-        with open(last_id_file, "w") as f:
-            f.write(str(history_id))  # 🔄 Always update history
+        except Exception as e:
+            if not is_history_expired(e):
+                raise
+            print("🕳️ startHistoryId", last_history_id, "expired — recovering gap.")
+            return await recover_expired_history(gmail_service, mailbox, history_id)
 
-        messages_added = []
-        for h in history_response.get("history", []):
-            messages_added.extend(h.get("messagesAdded", []))
+        message_ids = inbox_message_ids(history_response.get("history", []))
 
-        if not messages_added:
+        if not message_ids:
+            save_history_id(mailbox, history_id)
             print("⏩ No new messages added — skipping.")
             return {"status": "no_new_email"}
 
-        print("✅ New message detected — fetching latest inbox message")
-        parsed_email = fetch_latest_email()
-        if parsed_email and parsed_email.otp:
-            username = parsed_email.to_email.split("@")[0]
-            print("✅ Parsed email has OTP. Signaling workflow...")
-            await signal_workflow_with_otp(
-                platform=parsed_email.platform, username=username, otp=parsed_email.otp
-            )
-        else:
-            print("⚠️ Parsed email had no OTP or was not recent.")
+        print(f"✅ {len(message_ids)} new message(s) detected — parsing (cache first)")
+        parsed_emails = await asyncio.to_thread(parse_messages, gmail_service, mailbox, message_ids)
+        summary = await signal_otps(mailbox, parsed_emails)
+        if not summary.signaled:
+            print("⚠️ No new OTP signaled.")
+
+        # 🔄 Hold the cursor only for retryable failures; the next push retries them from
+        # the cache, while already delivered and rejected OTPs are skipped
+        if summary.retryable:
+            return {"status": "signal-retry", **summary.model_dump()}
+        save_history_id(mailbox, history_id)
 
     except Exception as e:
         print("❌ Error in webhook:", e)
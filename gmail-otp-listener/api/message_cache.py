@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Generic, TypeVar
+
+V = TypeVar("V")
+
+_MISSING = object()
+
+
+class MessageCache(Generic[V]):
+    """Bounded LRU cache of parse results keyed by (mailbox, message ID).
+
+    Entries expire `ttl_seconds` after they were stored. A cached value of
+    `None` means "parsed, not an OTP" and is a hit like any other value.
+    The cache also remembers which messages already had their OTP signaled.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple[str, str], tuple[float, V | object | None, bool]] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def _live_entry(self, key: tuple[str, str]) -> tuple[float, V | object | None, bool] | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, mailbox: str, msg_id: str, default: object = _MISSING) -> V | object | None:
+        """Return the cached result, or `default` on a miss."""
+        with self._lock:
+            entry = self._live_entry((mailbox, msg_id))
+            # A signaled-only placeholder (no parse result stored yet) is still a miss
+            if entry is None or entry[1] is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[1]
+
+    def put(self, mailbox: str, msg_id: str, value: V | None) -> None:
+        with self._lock:
+            key = (mailbox, msg_id)
+            entry = self._live_entry(key)
+            signaled = entry[2] if entry else False
+            self._entries[key] = (time.monotonic(), value, signaled)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def mark_signaled(self, mailbox: str, msg_id: str) -> bool:
+        """Record that the OTP of this message was signaled.
+
+        Returns False if it had already been signaled, so callers signal at most once.
+        """
+        with self._lock:
+            key = (mailbox, msg_id)
+            entry = self._live_entry(key)
+            if entry is None:
+                self._entries[key] = (time.monotonic(), _MISSING, True)
+            elif entry[2]:
+                return False
+            else:
+                self._entries[key] = (entry[0], entry[1], True)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            return True
+
+    def clear_signaled(self, mailbox: str, msg_id: str) -> None:
+        """Undo `mark_signaled` after a failed delivery so the OTP can be retried."""
+        with self._lock:
+            key = (mailbox, msg_id)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (entry[0], entry[1], False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections.abc import Callable
+from datetime import timedelta
+
+from pydantic import BaseModel
+
+from api.config import settings
+
+
+class WatchState(BaseModel):
+    history_id: str | None = None
+    expiration_ms: int | None = None
+    watch_history_id: str | None = None
+    last_synced_at: float | None = None
+
+
+# Serializes read-modify-write of WATCH_STATE_FILE between the webhook and the renewal thread
+_state_lock = threading.Lock()
+
+
+def _load_all_states() -> dict[str, dict]:
+    if not os.path.exists(settings.WATCH_STATE_FILE):
+        return {}
+    with open(settings.WATCH_STATE_FILE) as f:
+        return json.load(f)
+
+
+def _write_all_states(states: dict[str, dict]) -> None:
+    # Write-then-rename so readers never see a truncated file
+    tmp_file = f"{settings.WATCH_STATE_FILE}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(states, f)
+    os.replace(tmp_file, settings.WATCH_STATE_FILE)
+
+
+def load_watch_state(mailbox: str) -> WatchState:
+    return WatchState(**_load_all_states().get(mailbox, {}))
+
+
+def update_watch_state(mailbox: str, **changes) -> WatchState:
+    """Atomically apply `changes` to the stored state of `mailbox`."""
+    with _state_lock:
+        states = _load_all_states()
+        state = WatchState(**states.get(mailbox, {})).model_copy(update=changes)
+        states[mailbox] = state.model_dump()
+        _write_all_states(states)
+    return state
+
+
+def load_history_id(mailbox: str) -> str | None:
+    """History cursor of `mailbox`, falling back to the legacy global HISTORY_ID_FILE."""
+    history_id = load_watch_state(mailbox).history_id
+    if history_id is not None or not os.path.exists(settings.HISTORY_ID_FILE):
+        return history_id
+    with open(settings.HISTORY_ID_FILE) as f:
+        return f.read().strip()
+
+
+def save_history_id(mailbox: str, history_id: str) -> None:
+    """Advance the history cursor and remember when the mailbox was last in sync."""
+    update_watch_state(mailbox, history_id=str(history_id), last_synced_at=time.time())
+
+
+# === Watch lifecycle ===
+def mailbox_address(gmail_service) -> str:
+    """Email address of the authenticated mailbox, as reported in Pub/Sub notifications."""
+    return gmail_service.users().getProfile(userId="me").execute()["emailAddress"]
+
+
+def start_watch(gmail_service, mailbox: str) -> dict:
+    """(Re)create the Gmail push watch and record its expiry."""
+    request_body = {
+        "labelIds": ["UNREAD"],
+        "topicName": settings.GMAIL_TOPIC_NAME,
+    }
+    response = gmail_service.users().watch(userId="me", body=request_body).execute()
+
+    state = update_watch_state(
+        mailbox,
+        expiration_ms=int(response["expiration"]),
+        watch_history_id=str(response["historyId"]),
+    )
+    print(f"👀 Watch set for {mailbox}, expires at {state.expiration_ms}.")
+    return response
+
+
+def watch_needs_renewal(state: WatchState, now: float | None = None) -> bool:
+    if state.expiration_ms is None:
+        return True
+    now = time.time() if now is None else now
+    return state.expiration_ms / 1000 - now <= settings.WATCH_RENEW_BEFORE_SECONDS
+
+
+def renew_watch_if_due(gmail_service, mailbox: str) -> dict | None:
+    if not watch_needs_renewal(load_watch_state(mailbox)):
+        return None
+    print(f"🔁 Watch for {mailbox} missing or close to expiry, renewing...")
+    return start_watch(gmail_service, mailbox)
+
+
+def _renew_authenticated_mailbox(build_service: Callable) -> dict | None:
+    gmail_service = build_service()
+    return renew_watch_if_due(gmail_service, mailbox_address(gmail_service))
+
+
+async def run_watch_renewal(build_service: Callable) -> None:
+    """Background loop: renew the mailbox watch ahead of its 7-day expiry."""
+    while True:
+        try:
+            await asyncio.to_thread(_renew_authenticated_mailbox, build_service)
+        except Exception as e:
+            print("❌ Error renewing Gmail watch:", e)
+        await asyncio.sleep(settings.WATCH_CHECK_INTERVAL_SECONDS)
+
+
+# === History gap recovery ===
+def is_history_expired(error: Exception) -> bool:
+    """history.list answers 404 when startHistoryId is older than Gmail retains."""
+    from googleapiclient.errors import HttpError
+
+    return isinstance(error, HttpError) and error.resp.status == 404
+
+
+def recovery_query(since: float, senders: list[str]) -> str:
+    """Gmail search query covering only the gap since `since` (epoch seconds)."""
+    query = f"after:{int(since)}"
+    if senders:
+        query += " from:(" + " OR ".join(senders) + ")"
+    return query
+
+
+def recover_history_gap(gmail_service, mailbox: str, max_age: timedelta) -> list[str]:
+    """List message IDs received since the last sync, bounded in time and count.
+
+    The window never reaches further back than `max_age`: older messages cannot carry a
+    usable OTP, so listing them would only cost fetches that get thrown away.
+    """
+    window_start = time.time() - max_age.total_seconds()
+    last_synced_at = load_watch_state(mailbox).last_synced_at
+    since = max(last_synced_at, window_start) if last_synced_at else window_start
+    query = recovery_query(since, settings.GMAIL_OTP_SENDERS)
+    print(f"🩹 Recovering history gap for {mailbox} with query: {query}")
+
+    message_ids: list[str] = []
+    page_token = None
+    while len(message_ids) < settings.HISTORY_RECOVERY_MAX_MESSAGES:
+        response = (
+            gmail_service.users()
+            .messages()
+            .list(
+                userId="me",
+                q=query,
+                maxResults=settings.HISTORY_RECOVERY_MAX_MESSAGES - len(message_ids),
+                pageToken=page_token,
+            )
+            .execute()
+        )
+        message_ids.extend(m["id"] for m in response.get("messages", []))
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            break
+
+    print(f"🩹 Recovered {len(message_ids)} message(s) for {mailbox}.")
+    return message_ids
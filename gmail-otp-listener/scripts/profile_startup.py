@@ -0,0 +1,172 @@
+"""Measure listener cold start: import-time breakdown and time to first webhook response.
+
+Each measurement runs in a fresh interpreter so nothing is already imported. The
+first webhook carries a real historyId and runs the whole handler (Gmail client
+build, history.list, minimal message fetch, HTML parsing) against canned Gmail
+responses; OAuth token loading, Gmail network latency and Restate signaling are
+not included.
+
+    uv run python scripts/profile_startup.py [--top 20]
+"""
+
+import argparse
+import base64
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from email.utils import formatdate
+from pathlib import Path
+
+# Run against the listener package regardless of the current directory
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+PROFILE_MAILBOX = "profile@example.com"
+
+
+def import_breakdown(top: int) -> None:
+    """Print the slowest imports of `api.main` using `python -X importtime`."""
+    result = subprocess.run(  # noqa: S603
+        [sys.executable, "-X", "importtime", "-c", "import api.main"],
+        capture_output=True,
+        text=True,
+        check=False,
+        cwd=PROJECT_ROOT,
+    )
+    if result.returncode != 0:
+        print("❌ Importing api.main failed:\n", result.stderr.splitlines()[-1])
+        return
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(cumulative_us), int(self_us), depth - 1, name.strip()))
+
+    total_us = max((row[0] for row in rows), default=0)
+    print(f"📦 Import `api.main`: {total_us / 1000:.1f} ms total")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative_us, self_us, depth, name in sorted(rows, reverse=True)[:top]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {'  ' * depth}{name}")
+
+
+def first_response() -> None:
+    """Child process: time import, startup (lifespan warm-up) and the first webhook call."""
+    start = time.perf_counter()
+    from fastapi.testclient import TestClient
+
+    import api.main
+    from api.main import app
+
+    imported = time.perf_counter()
+    _stub_gmail(api.main)
+
+    # historyId is newer than the seeded cursor, so the handler does the full Gmail path
+    payload = base64.b64encode(
+        json.dumps({"emailAddress": PROFILE_MAILBOX, "historyId": 1001}).encode()
+    )
+    body = {"message": {"data": payload.decode()}, "subscription": "profile"}
+
+    with TestClient(app) as client:
+        started = time.perf_counter()
+        response = client.post("/gmail-webhook", json=body)
+        responded = time.perf_counter()
+
+    print(
+        json.dumps({
+            "import_ms": round((imported - start) * 1000, 1),
+            "startup_ms": round((started - imported) * 1000, 1),
+            "first_webhook_ms": round((responded - started) * 1000, 1),
+            "time_to_first_response_ms": round((responded - start) * 1000, 1),
+            "status": response.json().get("status"),
+        })
+    )
+
+
+def _stub_gmail(main_module) -> None:
+    """Serve Gmail calls from canned responses; the client itself is still really built."""
+    html = "<p>Profiling message without an OTP</p>"
+    structure = {
+        "id": "profile-1",
+        "payload": {
+            "partId": "",
+            "mimeType": "text/html",
+            "headers": [
+                {"name": "Date", "value": formatdate(localtime=True)},
+                {"name": "From", "value": "otp@example.com"},
+                {"name": "To", "value": PROFILE_MAILBOX},
+            ],
+            "body": {"size": len(html)},
+        },
+    }
+    body_data = base64.urlsafe_b64encode(html.encode()).decode()
+    responses = [
+        {"history": [{"messagesAdded": [{"message": {"id": "profile-1"}}]}]},
+        structure,
+        {"payload": {"partId": "", "body": {"data": body_data}}},
+    ]
+
+    def build_gmail_service(creds):
+        from googleapiclient.discovery import build_from_document
+        from googleapiclient.http import HttpMockSequence
+
+        http = HttpMockSequence([({"status": "200"}, json.dumps(r)) for r in responses])
+        return build_from_document(main_module.gmail_discovery_document(), http=http)
+
+    main_module.existing_gmail_service = lambda: build_gmail_service(None)
+
+
+def _run_child(warm_up: bool) -> dict | None:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        state_file = Path(tmp_dir) / "watch_state.json"
+        state_file.write_text(json.dumps({PROFILE_MAILBOX: {"history_id": "1000"}}))
+        env = {
+            **os.environ,
+            "WATCH_STATE_FILE": str(state_file),
+            "WATCH_RENEWAL_ENABLED": "false",
+            "WARM_UP_ON_STARTUP": str(warm_up).lower(),
+        }
+        result = subprocess.run(  # noqa: S603
+            [sys.executable, __file__, "--child"],
+            capture_output=True,
+            text=True,
+            check=False,
+            cwd=PROJECT_ROOT,
+            env=env,
+        )
+    if result.returncode != 0:
+        print("❌ First-response measurement failed:\n", result.stderr.splitlines()[-1])
+        return None
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--top", type=int, default=20, help="Number of imports to list")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        first_response()
+        return
+
+    import_breakdown(args.top)
+
+    for warm_up in (True, False):
+        timings = _run_child(warm_up)
+        if timings is None:
+            return
+        label = "with startup warm-up" if warm_up else "without warm-up"
+        print(f"\n⏱️ Time to first webhook response (fresh process, {label}):")
+        for name, value in timings.items():
+            print(f"  {name}: {value}")
+    print("\n📝 Gmail is served from canned responses; token loading and signaling excluded.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate
+from unittest.mock import MagicMock
+
+import httplib2
+import httpx
+import pytest
+from googleapiclient.errors import HttpError
+
+import api.backfill
+import api.main
+from api.backfill import (
+    backfill,
+    chunked,
+    fetch_structures_batch,
+    list_history_message_ids,
+    list_range_message_ids,
+)
+from api.main import ParsedEmail
+from api.message_cache import MessageCache
+
+
+class TestChunked:
+    def test_splits_into_bounded_batches(self):
+        assert chunked(["a", "b", "c", "d", "e"], 2) == [["a", "b"], ["c", "d"], ["e"]]
+
+    def test_empty(self):
+        assert chunked([], 50) == []
+
+
+def _structure(minutes_ago: float) -> dict:
+    date = formatdate(time.time() - minutes_ago * 60, localtime=True)
+    return {"payload": {"headers": [{"name": "Date", "value": date}]}}
+
+
+@pytest.fixture
+def gmail(monkeypatch):
+    structures = {
+        "recent-otp": _structure(1),
+        "recent-plain": _structure(1),
+        "old-otp": _structure(60),
+    }
+
+    def fetch_structures_batch(chunk):
+        return {msg_id: structures[msg_id] for msg_id in chunk}
+
+    def parse_structure(msg_id, structure):
+        return ParsedEmail(
+            from_email="otp@zepto.co",
+            to_email="store@example.com",
+            otp="1234" if msg_id.endswith("otp") else None,
+            platform="zepto",
+            message_id=msg_id,
+        )
+
+    monkeypatch.setattr(api.backfill, "fetch_structures_batch", fetch_structures_batch)
+    monkeypatch.setattr(api.backfill, "parse_structure", parse_structure)
+    monkeypatch.setattr(api.main, "_workflow_client", None)
+    monkeypatch.setattr(api.main, "message_cache", MessageCache(max_size=10, ttl_seconds=60))
+    return list(structures)
+
+
+def _run(message_ids, dry_run=False):
+    return backfill(
+        mailbox="backfill@example.com",
+        message_ids=message_ids,
+        max_age=timedelta(minutes=15),
+        concurrency=2,
+        batch_size=2,
+        dry_run=dry_run,
+    )
+
+
+def _patch_pending(monkeypatch, pending: bool):
+    async def workflow_is_pending(platform, username):
+        return pending
+
+    monkeypatch.setattr(api.backfill, "workflow_is_pending", workflow_is_pending)
+
+
+class TestBackfill:
+    async def test_signals_recent_otps_of_pending_workflows(self, gmail, monkeypatch):
+        _patch_pending(monkeypatch, True)
+        signals = []
+
+        async def fake_signal(**kwargs):
+            signals.append(kwargs)
+            return httpx.Response(202, request=httpx.Request("POST", "http://restate"))
+
+        monkeypatch.setattr(api.main, "signal_workflow_with_otp", fake_signal)
+
+        stats = await _run(gmail)
+
+        assert stats["fetched"] == 3
+        assert stats["recent"] == 2
+        assert stats["otps"] == 1
+        assert stats["signaled"] == 1
+        assert signals == [{"platform": "zepto", "username": "store", "otp": "1234"}]
+
+    async def test_skips_workflows_that_are_not_pending(self, gmail, monkeypatch):
+        _patch_pending(monkeypatch, False)
+
+        stats = await _run(gmail)
+
+        assert stats["not_pending"] == 1
+        assert stats["signaled"] == 0
+
+    async def test_dry_run_does_not_signal(self, gmail, monkeypatch):
+        _patch_pending(monkeypatch, True)
+
+        async def fail_signal(**kwargs):
+            raise AssertionError("dry run must not signal")
+
+        monkeypatch.setattr(api.main, "signal_workflow_with_otp", fail_signal)
+
+        stats = await _run(gmail, dry_run=True)
+
+        assert stats["otps"] == 1
+        assert stats["signaled"] == 0
+
+    async def test_signal_errors_are_counted_not_raised(self, gmail, monkeypatch):
+        _patch_pending(monkeypatch, True)
+
+        async def unreachable(**kwargs):
+            raise httpx.ConnectError("restate down")
+
+        monkeypatch.setattr(api.main, "signal_workflow_with_otp", unreachable)
+
+        stats = await _run(gmail)
+
+        assert stats["signal_failed"] == 1
+        assert "messages_per_s" in stats
+        assert api.main.message_cache.mark_signaled("backfill@example.com", "recent-otp")
+
+    async def test_only_newest_otp_per_workflow_is_signaled(self, monkeypatch):
+        # The resend is listed first and the original parses last, as with concurrent parsing
+        structures = {"resend": _structure(1), "original": _structure(3)}
+        otps = {"resend": "2222", "original": "1111"}
+
+        def parse_structure(msg_id, structure):
+            parsed = api.main.extract_otp_email(
+                f"Your otp code is {otps[msg_id]}",
+                ["otp@zepto.co"],
+                ["store@example.com"],
+                structure["payload"]["headers"][0]["value"],
+            )
+            parsed.message_id = msg_id
+            return parsed
+
+        monkeypatch.setattr(
+            api.backfill, "fetch_structures_batch", lambda chunk: {m: structures[m] for m in chunk}
+        )
+        monkeypatch.setattr(api.backfill, "parse_structure", parse_structure)
+        monkeypatch.setattr(api.main, "_workflow_client", None)
+        monkeypatch.setattr(api.main, "message_cache", MessageCache(max_size=10, ttl_seconds=60))
+        _patch_pending(monkeypatch, True)
+        signals = []
+
+        async def fake_signal(**kwargs):
+            signals.append(kwargs["otp"])
+            return httpx.Response(202, request=httpx.Request("POST", "http://restate"))
+
+        monkeypatch.setattr(api.main, "signal_workflow_with_otp", fake_signal)
+
+        stats = await _run(["resend", "original"])
+
+        assert signals == ["2222"]
+        assert stats["otps"] == 2
+        assert stats["superseded"] == 1
+        assert stats["signaled"] == 1
+
+
+class TestListing:
+    def test_history_pages_are_followed_and_deduplicated(self):
+        service = MagicMock()
+        history = service.users.return_value.history.return_value.list
+        history.return_value.execute.side_effect = [
+            {
+                "history": [{"messagesAdded": [{"message": {"id": "m1"}}]}],
+                "historyId": "11",
+                "nextPageToken": "p2",
+            },
+            {
+                "history": [
+                    {
+                        "messagesAdded": [
+                            {"message": {"id": "m1"}},
+                            {"message": {"id": "m2", "labelIds": ["INBOX"]}},
+                            {"message": {"id": "sent", "labelIds": ["SENT"]}},
+                        ]
+                    }
+                ],
+                "historyId": "12",
+            },
+        ]
+
+        message_ids, latest = list_history_message_ids(service, "10")
+
+        assert message_ids == ["m1", "m2"]
+        assert latest == "12"
+        assert history.call_args.kwargs["pageToken"] == "p2"
+
+    def test_time_range_query(self):
+        service = MagicMock()
+        listing = service.users.return_value.messages.return_value.list
+        listing.return_value.execute.return_value = {"messages": [{"id": "m1"}]}
+        since = datetime(2026, 10, 19, 9, tzinfo=timezone.utc)
+        until = since + timedelta(hours=1)
+
+        assert list_range_message_ids(service, since, until) == ["m1"]
+        query = listing.call_args.kwargs["q"]
+        assert query.startswith(f"after:{int(since.timestamp())}")
+        assert query.endswith(f"before:{int(until.timestamp())}")
+
+    def test_structures_are_fetched_in_one_batch(self, monkeypatch):
+        service = MagicMock()
+        added = []
+
+        def new_batch_http_request(callback):
+            batch = MagicMock()
+            batch.add.side_effect = lambda request, request_id: added.append(request_id)
+
+            def execute():
+                callback("m1", {"id": "m1"}, None)
+                callback("m2", None, RuntimeError("gone"))
+
+            batch.execute.side_effect = execute
+            return batch
+
+        service.new_batch_http_request.side_effect = new_batch_http_request
+        monkeypatch.setattr(api.backfill, "_thread_service", lambda: service)
+
+        assert fetch_structures_batch(["m1", "m2"]) == {"m1": {"id": "m1"}}
+        assert added == ["m1", "m2"]
+
+
+class TestCli:
+    @pytest.fixture
+    def gmail_service(self, monkeypatch):
+        service = MagicMock()
+        monkeypatch.setattr(api.backfill, "existing_gmail_service", lambda: service)
+        monkeypatch.setattr(api.backfill, "mailbox_address", lambda s: "me@example.com")
+        return service
+
+    def _main(self, monkeypatch, *argv):
+        monkeypatch.setattr("sys.argv", ["backfill", *argv])
+        api.backfill.main()
+
+    def test_rejects_other_mailbox(self, gmail_service, monkeypatch):
+        with pytest.raises(SystemExit):
+            self._main(monkeypatch, "--mailbox", "other@example.com", "--start-history-id", "1")
+
+    def test_expired_history_id_suggests_time_range(self, gmail_service, monkeypatch, capsys):
+        expired = HttpError(httplib2.Response({"status": 404}), b"not found")
+        history = gmail_service.users.return_value.history.return_value.list
+        history.return_value.execute.side_effect = expired
+
+        with pytest.raises(SystemExit):
+            self._main(monkeypatch, "--mailbox", "me@example.com", "--start-history-id", "1")
+
+        assert "--since" in capsys.readouterr().err
+
+    def test_dry_run_reports_stats(self, gmail_service, monkeypatch, capsys):
+        listing = gmail_service.users.return_value.messages.return_value.list
+        listing.return_value.execute.return_value = {}
+
+        self._main(
+            monkeypatch, "--mailbox", "me@example.com", "--since", "2026-10-19T09:00", "--dry-run"
+        )
+
+        assert "Backfill complete" in capsys.readouterr().out
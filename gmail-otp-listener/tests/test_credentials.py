@@ -0,0 +1,67 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from google_auth_oauthlib.flow import InstalledAppFlow
+
+import api.main
+from api.config import settings
+from api.main import existing_gmail_service, load_existing_credentials, warm_up
+
+
+@pytest.fixture(autouse=True)
+def token_file(monkeypatch, tmp_path):
+    def no_flow(*args, **kwargs):
+        raise AssertionError("interactive OAuth flow must not start")
+
+    monkeypatch.setattr(InstalledAppFlow, "from_client_secrets_file", no_flow)
+    monkeypatch.setattr(api.main, "_credentials", None)
+    path = tmp_path / "token.json"
+    monkeypatch.setattr(settings, "TOKEN_FILE", str(path))
+    return path
+
+
+def _expiry(delta: timedelta) -> str:
+    return (datetime.now(timezone.utc) + delta).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _token(**overrides) -> dict:
+    token = {
+        "token": "access",
+        "client_id": "client",
+        "client_secret": "secret",
+        "scopes": api.main.SCOPES,
+    }
+    return {**token, **overrides}
+
+
+class TestLoadExistingCredentials:
+    def test_missing_token_file(self):
+        assert load_existing_credentials() is None
+
+    def test_malformed_token_file(self, token_file):
+        token_file.write_text("{not json")
+        assert load_existing_credentials() is None
+
+    def test_expired_without_refresh_token(self, token_file):
+        token_file.write_text(json.dumps(_token(expiry=_expiry(-timedelta(hours=1)))))
+        assert load_existing_credentials() is None
+
+    def test_valid_token_is_loaded_and_reused(self, token_file):
+        token = _token(refresh_token="refresh", expiry=_expiry(timedelta(hours=1)))  # noqa: S106
+        token_file.write_text(json.dumps(token))
+        creds = load_existing_credentials()
+        assert creds.token == "access"  # noqa: S105
+        token_file.unlink()
+        assert load_existing_credentials() is creds
+
+    def test_existing_gmail_service_raises_without_token(self):
+        with pytest.raises(RuntimeError):
+            existing_gmail_service()
+
+
+class TestWarmUp:
+    def test_warm_up_never_starts_oauth_flow(self, token_file):
+        token_file.write_text("{not json")
+        timings = warm_up()
+        assert set(timings) >= {"discovery_document_ms", "gmail_client_ms"}
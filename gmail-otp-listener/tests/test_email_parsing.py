@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from email.utils import format_datetime
+
+from api.main import extract_otp_email, is_fresh, parse_email
+
+
+def _date(minutes_ago: float) -> str:
+    return format_datetime(datetime.now(timezone.utc) - timedelta(minutes=minutes_ago))
+
+
+def _raw_email(minutes_ago: float, html: str) -> bytes:
+    msg = EmailMessage()
+    msg["From"] = "Zepto <otp@zepto.co>"
+    msg["To"] = "Store User <store.user@example.com>"
+    msg["Date"] = _date(minutes_ago)
+    msg["Subject"] = "OTP"
+    msg.set_content("plain fallback")
+    msg.add_alternative(html, subtype="html")
+    return msg.as_bytes()
+
+
+class TestIsFresh:
+    def test_recent_email_is_fresh(self):
+        assert is_fresh(_date(1))
+
+    def test_old_email_is_stale(self):
+        assert not is_fresh(_date(5))
+
+    def test_custom_max_age(self):
+        assert is_fresh(_date(5), max_age=timedelta(minutes=10))
+
+    def test_missing_date_is_stale(self):
+        assert not is_fresh(None)
+
+
+class TestExtractOtpEmail:
+    def test_extracts_otp_and_header_addresses(self):
+        parsed = extract_otp_email(
+            "<p>Your OTP code is 4821</p>", ["Zepto <otp@zepto.co>"], ["user@example.com"]
+        )
+        assert parsed.otp == "4821"
+        assert parsed.from_email == "otp@zepto.co"
+        assert parsed.to_email == "user@example.com"
+
+    def test_prefers_addresses_from_forwarded_body(self):
+        body = (
+            "<div>From: Zepto &lt;real@zepto.co&gt;</div>\n"
+            "<div>To: Store &lt;store@example.com&gt;</div>\n"
+            "<p>Your otp code is 1111</p>"
+        )
+        parsed = extract_otp_email(body, ["fwd@example.com"], ["me@example.com"])
+        assert parsed.from_email == "real@zepto.co"
+        assert parsed.to_email == "store@example.com"
+
+    def test_no_otp(self):
+        parsed = extract_otp_email("<p>Hello</p>", ["a@b.co"], ["c@d.co"])
+        assert parsed.otp is None
+
+
+class TestParseEmail:
+    def test_parses_raw_mime(self):
+        parsed = parse_email(_raw_email(0.5, "<p>Your otp code is 9876</p>"))
+        assert parsed.otp == "9876"
+        assert parsed.to_email == "store.user@example.com"
+
+    def test_stale_raw_mime_is_ignored(self):
+        assert parse_email(_raw_email(10, "<p>Your otp code is 9876</p>")) is None
@@ -0,0 +1,157 @@
+import base64
+from unittest.mock import MagicMock
+
+from api.gmail_fetch import (
+    STRUCTURE_FIELDS,
+    _data_fields,
+    _find_part,
+    _part_fields,
+    fetch_message_body,
+    message_headers,
+)
+
+
+def _b64(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode()).decode()
+
+
+STRUCTURE = {
+    "id": "m1",
+    "payload": {
+        "partId": "",
+        "mimeType": "multipart/mixed",
+        "headers": [
+            {"name": "From", "value": "Zepto <otp@zepto.co>"},
+            {"name": "To", "value": "user@example.com"},
+        ],
+        "parts": [
+            {
+                "partId": "0",
+                "mimeType": "multipart/alternative",
+                "parts": [
+                    {"partId": "0.0", "mimeType": "text/plain", "body": {"size": 20}},
+                    {"partId": "0.1", "mimeType": "text/html", "body": {"size": 40}},
+                ],
+            },
+            {
+                "partId": "1",
+                "mimeType": "text/html",
+                "filename": "invoice.html",
+                "body": {"size": 9000, "attachmentId": "att-1"},
+            },
+        ],
+    },
+}
+
+
+class TestFieldMasks:
+    def test_part_fields_nests_to_depth(self):
+        assert _part_fields(0, "mimeType") == "mimeType"
+        assert _part_fields(2, "mimeType") == "mimeType,parts(mimeType,parts(mimeType))"
+
+    def test_structure_fields_exclude_body_data(self):
+        assert "body/data" not in STRUCTURE_FIELDS
+        assert "attachmentId" in STRUCTURE_FIELDS
+
+    def test_structure_fields_include_part_headers(self):
+        assert "parts(partId,mimeType,filename,headers," in STRUCTURE_FIELDS
+
+    def test_data_fields_target_exact_depth(self):
+        assert _data_fields(0) == "payload(partId,body/data)"
+        assert _data_fields(2) == "payload(parts(parts(partId,body/data)))"
+
+
+class TestFindPart:
+    def test_finds_nested_html_part_with_depth(self):
+        part, depth = _find_part(STRUCTURE["payload"], "text/html")
+        assert part["partId"] == "0.1"
+        assert depth == 2
+
+    def test_skips_attachments(self):
+        payload = {"mimeType": "multipart/mixed", "parts": [STRUCTURE["payload"]["parts"][1]]}
+        assert _find_part(payload, "text/html") is None
+
+    def test_message_headers_are_lower_cased(self):
+        headers = message_headers(STRUCTURE["payload"])
+        assert headers["from"] == ["Zepto <otp@zepto.co>"]
+        assert headers["to"] == ["user@example.com"]
+
+
+class TestFetchMessageBody:
+    def test_downloads_only_the_html_part(self):
+        service = MagicMock()
+        get = service.users.return_value.messages.return_value.get
+        get.return_value.execute.return_value = {
+            "payload": {
+                "parts": [
+                    {
+                        "parts": [
+                            {"partId": "0.0", "body": {"data": _b64("plain")}},
+                            {
+                                "partId": "0.1",
+                                "body": {"data": _b64("<p>Your otp code is 1234</p>")},
+                            },
+                        ]
+                    }
+                ]
+            }
+        }
+
+        message = fetch_message_body(service, "m1", STRUCTURE, max_body_bytes=1000)
+
+        assert message.mime_type == "text/html"
+        assert message.body == "<p>Your otp code is 1234</p>"
+        get.assert_called_once_with(userId="me", id="m1", format="full", fields=_data_fields(2))
+
+    def test_skips_parts_over_the_size_limit(self):
+        service = MagicMock()
+
+        message = fetch_message_body(service, "m1", STRUCTURE, max_body_bytes=10)
+
+        assert message.body == ""
+        service.users.assert_not_called()
+
+    def test_limit_covers_inline_siblings(self):
+        # The HTML part alone (40 bytes) fits, but its text/plain sibling is downloaded too
+        service = MagicMock()
+
+        message = fetch_message_body(service, "m1", STRUCTURE, max_body_bytes=50)
+
+        assert message.body == ""
+        service.users.assert_not_called()
+
+    def test_decodes_with_declared_charset(self):
+        html = "<p>Código 1234</p>"
+        structure = {
+            "payload": {
+                "partId": "",
+                "mimeType": "text/html",
+                "headers": [{"name": "Content-Type", "value": 'text/html; charset="ISO-8859-1"'}],
+                "body": {"size": len(html)},
+            }
+        }
+        data = base64.urlsafe_b64encode(html.encode("latin-1")).decode()
+        service = MagicMock()
+        get = service.users.return_value.messages.return_value.get
+        get.return_value.execute.return_value = {"payload": {"partId": "", "body": {"data": data}}}
+
+        message = fetch_message_body(service, "m1", structure, max_body_bytes=1000)
+
+        assert message.body == html
+
+    def test_out_of_line_body_uses_attachments_get(self):
+        structure = {
+            "payload": {
+                "partId": "",
+                "mimeType": "text/html",
+                "body": {"size": 50, "attachmentId": "att-9"},
+            }
+        }
+        service = MagicMock()
+        attachments = service.users.return_value.messages.return_value.attachments.return_value
+        attachments.get.return_value.execute.return_value = {"data": _b64("<b>hi</b>")}
+
+        message = fetch_message_body(service, "m1", structure, max_body_bytes=1000)
+
+        assert message.body == "<b>hi</b>"
+        attachments.get.assert_called_once_with(userId="me", messageId="m1", id="att-9")
@@ -0,0 +1,176 @@
+from datetime import UTC, datetime, timedelta
+
+import httpx
+import pytest
+
+import api.main
+from api.main import (
+    ParsedEmail,
+    is_retryable_signal_error,
+    latest_otp_per_workflow,
+    message_cache,
+    signal_otp_once,
+    signal_otps,
+)
+from api.message_cache import MessageCache
+
+MISS = object()
+
+
+class TestMessageCache:
+    def test_hit_and_miss_counters(self):
+        cache = MessageCache(max_size=10, ttl_seconds=60)
+        assert cache.get("inbox", "m1", default=MISS) is MISS
+        cache.put("inbox", "m1", "parsed")
+        assert cache.get("inbox", "m1", default=MISS) == "parsed"
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_not_an_otp_is_cached(self):
+        cache = MessageCache(max_size=10, ttl_seconds=60)
+        cache.put("inbox", "m1", None)
+        assert cache.get("inbox", "m1", default=MISS) is None
+
+    def test_keys_include_mailbox(self):
+        cache = MessageCache(max_size=10, ttl_seconds=60)
+        cache.put("a@example.com", "m1", "a")
+        assert cache.get("b@example.com", "m1", default=MISS) is MISS
+
+    def test_evicts_least_recently_used(self):
+        cache = MessageCache(max_size=2, ttl_seconds=60)
+        cache.put("inbox", "m1", 1)
+        cache.put("inbox", "m2", 2)
+        cache.get("inbox", "m1")
+        cache.put("inbox", "m3", 3)
+        assert cache.get("inbox", "m2", default=MISS) is MISS
+        assert cache.get("inbox", "m1", default=MISS) == 1
+
+    def test_entries_expire_after_ttl(self, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr("api.message_cache.time.monotonic", lambda: now[0])
+        cache = MessageCache(max_size=10, ttl_seconds=60)
+        cache.put("inbox", "m1", 1)
+        now[0] += 61
+        assert cache.get("inbox", "m1", default=MISS) is MISS
+        assert cache.stats()["size"] == 0
+
+    def test_signaled_at_most_once(self):
+        cache = MessageCache(max_size=10, ttl_seconds=60)
+        cache.put("inbox", "m1", "parsed")
+        assert cache.mark_signaled("inbox", "m1")
+        assert not cache.mark_signaled("inbox", "m1")
+        cache.put("inbox", "m1", "reparsed")
+        assert not cache.mark_signaled("inbox", "m1")
+
+    def test_clear_signaled_allows_retry(self):
+        cache = MessageCache(max_size=10, ttl_seconds=60)
+        cache.put("inbox", "m1", "parsed")
+        cache.mark_signaled("inbox", "m1")
+        cache.clear_signaled("inbox", "m1")
+        assert cache.mark_signaled("inbox", "m1")
+
+    def test_signaled_placeholder_is_not_a_parse_result(self):
+        cache = MessageCache(max_size=10, ttl_seconds=60)
+        cache.mark_signaled("inbox", "m1")
+        assert cache.get("inbox", "m1", default=MISS) is MISS
+
+
+def _otp_email(
+    message_id: str,
+    to_email: str = "store@example.com",
+    otp: str = "1234",
+    sent_at: datetime | None = None,
+) -> ParsedEmail:
+    return ParsedEmail(
+        from_email="otp@zepto.co",
+        to_email=to_email,
+        otp=otp,
+        platform="zepto",
+        message_id=message_id,
+        sent_at=sent_at,
+    )
+
+
+def _response(status_code: int) -> httpx.Response:
+    return httpx.Response(status_code, request=httpx.Request("POST", "http://restate"))
+
+
+class TestSignalOtpOnce:
+    async def test_signals_once(self, monkeypatch):
+        calls = []
+
+        async def fake_signal(**kwargs):
+            calls.append(kwargs)
+            return _response(200)
+
+        monkeypatch.setattr(api.main, "signal_workflow_with_otp", fake_signal)
+        assert await signal_otp_once("inbox", _otp_email("sig-1"))
+        assert not await signal_otp_once("inbox", _otp_email("sig-1"))
+        assert calls == [{"platform": "zepto", "username": "store", "otp": "1234"}]
+
+    async def test_failed_delivery_is_retried(self, monkeypatch):
+        async def unreachable(**kwargs):
+            raise httpx.ConnectError("restate down")
+
+        monkeypatch.setattr(api.main, "signal_workflow_with_otp", unreachable)
+        with pytest.raises(httpx.ConnectError):
+            await signal_otp_once("inbox", _otp_email("sig-2"))
+        assert message_cache.mark_signaled("inbox", "sig-2")
+
+    async def test_non_2xx_is_a_failed_delivery(self, monkeypatch):
+        async def rejected(**kwargs):
+            return _response(500)
+
+        monkeypatch.setattr(api.main, "signal_workflow_with_otp", rejected)
+        with pytest.raises(httpx.HTTPStatusError):
+            await signal_otp_once("inbox", _otp_email("sig-3"))
+        assert message_cache.mark_signaled("inbox", "sig-3")
+
+    async def test_rejected_otp_stays_claimed(self, monkeypatch):
+        async def rejected(**kwargs):
+            return _response(409)
+
+        monkeypatch.setattr(api.main, "signal_workflow_with_otp", rejected)
+        with pytest.raises(httpx.HTTPStatusError):
+            await signal_otp_once("inbox", _otp_email("sig-4"))
+        assert not message_cache.mark_signaled("inbox", "sig-4")
+
+
+class TestSignalOtps:
+    def test_retryable_errors(self):
+        request = httpx.Request("POST", "http://restate")
+        assert is_retryable_signal_error(httpx.ConnectError("down", request=request))
+        assert is_retryable_signal_error(
+            httpx.HTTPStatusError("busy", request=request, response=_response(503))
+        )
+        assert not is_retryable_signal_error(
+            httpx.HTTPStatusError("resolved", request=request, response=_response(409))
+        )
+        assert not is_retryable_signal_error(ValueError("bug"))
+
+    def test_newest_otp_per_workflow_wins(self):
+        now = datetime.now(UTC)
+        resend = _otp_email("m2", otp="2222", sent_at=now)
+        emails = [
+            resend,
+            _otp_email("m1", otp="1111", sent_at=now - timedelta(seconds=30)),
+            _otp_email("m3", to_email="other@example.com"),
+            ParsedEmail(from_email="a@b.co", to_email="store@example.com"),
+        ]
+
+        assert [e.message_id for e in latest_otp_per_workflow(emails)] == ["m2", "m3"]
+
+    def test_list_order_breaks_ties_without_dates(self):
+        emails = [_otp_email("m1"), _otp_email("m2")]
+        assert [e.message_id for e in latest_otp_per_workflow(emails)] == ["m2"]
+
+    async def test_expired_otps_are_dropped(self, monkeypatch):
+        async def unexpected(**kwargs):
+            raise AssertionError("must not signal")
+
+        monkeypatch.setattr(api.main, "signal_workflow_with_otp", unexpected)
+        stale = _otp_email("old-1", sent_at=datetime.now(UTC) - timedelta(minutes=10))
+
+        summary = await signal_otps("inbox", [stale])
+
+        assert summary.model_dump() == {"signaled": 0, "rejected": 0, "retryable": 0}
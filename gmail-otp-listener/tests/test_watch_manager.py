@@ -0,0 +1,127 @@
+import json
+from datetime import timedelta
+from unittest.mock import MagicMock
+
+import pytest
+
+from api.config import settings
+from api.watch_manager import (
+    WatchState,
+    load_history_id,
+    load_watch_state,
+    recover_history_gap,
+    recovery_query,
+    renew_watch_if_due,
+    save_history_id,
+    update_watch_state,
+    watch_needs_renewal,
+)
+
+NOW = 1_760_000_000.0
+DAY = 24 * 3600
+
+
+@pytest.fixture(autouse=True)
+def state_files(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "WATCH_STATE_FILE", str(tmp_path / "watch_state.json"))
+    monkeypatch.setattr(settings, "HISTORY_ID_FILE", str(tmp_path / "last_history_id.txt"))
+    return tmp_path
+
+
+class TestWatchRenewal:
+    def test_missing_watch_needs_renewal(self):
+        assert watch_needs_renewal(WatchState(), now=NOW)
+
+    def test_renews_within_threshold_of_expiry(self):
+        expires_at = NOW + settings.WATCH_RENEW_BEFORE_SECONDS - 60
+        expiring = WatchState(expiration_ms=int(expires_at * 1000))
+        assert watch_needs_renewal(expiring, now=NOW)
+
+    def test_fresh_watch_is_left_alone(self):
+        fresh = WatchState(expiration_ms=int((NOW + 6 * DAY) * 1000))
+        assert not watch_needs_renewal(fresh, now=NOW)
+
+    def test_renew_records_expiry(self):
+        service = MagicMock()
+        service.users.return_value.watch.return_value.execute.return_value = {
+            "historyId": "555",
+            "expiration": "1760600000000",
+        }
+
+        renew_watch_if_due(service, "a@example.com")
+
+        state = load_watch_state("a@example.com")
+        assert state.expiration_ms == 1760600000000
+        assert state.watch_history_id == "555"
+
+
+class TestWatchState:
+    def test_updates_merge_fields(self):
+        update_watch_state("a@example.com", expiration_ms=1)
+        save_history_id("a@example.com", "42")
+
+        state = load_watch_state("a@example.com")
+        assert state.expiration_ms == 1
+        assert state.history_id == "42"
+        assert state.last_synced_at is not None
+
+    def test_write_is_atomic_and_leaves_no_temp_file(self, state_files):
+        update_watch_state("a@example.com", history_id="1")
+        assert json.loads((state_files / "watch_state.json").read_text())["a@example.com"]
+        assert not (state_files / "watch_state.json.tmp").exists()
+
+    def test_cursor_is_per_mailbox(self):
+        save_history_id("a@example.com", "10")
+        save_history_id("b@example.com", "20")
+        assert load_history_id("a@example.com") == "10"
+        assert load_history_id("b@example.com") == "20"
+
+    def test_falls_back_to_legacy_cursor_file(self, state_files):
+        (state_files / "last_history_id.txt").write_text("342013\n")
+        assert load_history_id("a@example.com") == "342013"
+        save_history_id("a@example.com", "342100")
+        assert load_history_id("a@example.com") == "342100"
+
+
+class TestHistoryGapRecovery:
+    def test_recovery_query(self):
+        assert recovery_query(NOW, []) == f"after:{int(NOW)}"
+        query = recovery_query(NOW, ["a@x.co", "b@y.co"])
+        assert query == f"after:{int(NOW)} from:(a@x.co OR b@y.co)"
+
+    def test_window_is_capped_at_max_age(self, monkeypatch):
+        monkeypatch.setattr("api.watch_manager.time.time", lambda: NOW)
+        update_watch_state("a@example.com", last_synced_at=NOW - DAY)
+        service = MagicMock()
+        list_call = service.users.return_value.messages.return_value.list
+        list_call.return_value.execute.return_value = {"messages": [{"id": "m1"}]}
+
+        message_ids = recover_history_gap(service, "a@example.com", timedelta(minutes=2))
+
+        assert message_ids == ["m1"]
+        assert list_call.call_args.kwargs["q"].startswith(f"after:{int(NOW - 120)}")
+
+    def test_window_starts_at_last_sync_when_recent(self, monkeypatch):
+        monkeypatch.setattr("api.watch_manager.time.time", lambda: NOW)
+        update_watch_state("a@example.com", last_synced_at=NOW - 30)
+        service = MagicMock()
+        list_call = service.users.return_value.messages.return_value.list
+        list_call.return_value.execute.return_value = {}
+
+        recover_history_gap(service, "a@example.com", timedelta(minutes=2))
+
+        assert list_call.call_args.kwargs["q"].startswith(f"after:{int(NOW - 30)}")
+
+    def test_message_count_is_bounded(self, monkeypatch):
+        monkeypatch.setattr(settings, "HISTORY_RECOVERY_MAX_MESSAGES", 3)
+        service = MagicMock()
+        list_call = service.users.return_value.messages.return_value.list
+        list_call.return_value.execute.side_effect = [
+            {"messages": [{"id": "m1"}, {"id": "m2"}], "nextPageToken": "p2"},
+            {"messages": [{"id": "m3"}], "nextPageToken": "p3"},
+        ]
+
+        message_ids = recover_history_gap(service, "a@example.com", timedelta(minutes=2))
+
+        assert message_ids == ["m1", "m2", "m3"]
+        assert list_call.call_args.kwargs["maxResults"] == 1
@@ -0,0 +1,328 @@
+import base64
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from unittest.mock import MagicMock
+
+import httplib2
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from googleapiclient.errors import HttpError
+
+import api.main
+from api.config import settings
+from api.main import (
+    app,
+    existing_gmail_service,
+    fetch_parsed_email,
+    inbox_message_ids,
+    message_cache,
+    workflow_is_pending,
+)
+from api.watch_manager import load_history_id
+
+MAILBOX = "webhook@example.com"
+
+
+def _b64(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode()).decode()
+
+
+def _message_responses(html: str, to: str = "store@example.com") -> list[dict]:
+    """messages.get answers for the minimal fetch: structure, then the body data."""
+    structure = {
+        "payload": {
+            "partId": "",
+            "mimeType": "text/html",
+            "headers": [
+                {"name": "Date", "value": formatdate(localtime=True)},
+                {"name": "From", "value": "otp@zepto.co"},
+                {"name": "To", "value": to},
+            ],
+            "body": {"size": len(html)},
+        }
+    }
+    return [structure, {"payload": {"partId": "", "body": {"data": _b64(html)}}}]
+
+
+def _restate_response(status_code: int) -> httpx.Response:
+    return httpx.Response(status_code, request=httpx.Request("POST", "http://restate"))
+
+
+def _push(history_id: int) -> dict:
+    data = json.dumps({"emailAddress": MAILBOX, "historyId": history_id}).encode()
+    return {"message": {"data": base64.b64encode(data).decode()}, "subscription": "sub"}
+
+
+@pytest.fixture
+def gmail(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "HISTORY_ID_FILE", str(tmp_path / "last_history_id.txt"))
+    monkeypatch.setattr(settings, "WATCH_STATE_FILE", str(tmp_path / "watch_state.json"))
+    (tmp_path / "last_history_id.txt").write_text("100")
+
+    service = MagicMock()
+    service.users.return_value.history.return_value.list.return_value.execute.return_value = {
+        "history": [
+            {"messagesAdded": [{"message": {"id": "cached-1", "labelIds": ["INBOX"]}}]},
+            {"messagesAdded": [{"message": {"id": "cached-1", "labelIds": ["INBOX"]}}]},
+        ]
+    }
+    monkeypatch.setattr(api.main, "message_cache", type(message_cache)(10, 60))
+    monkeypatch.setattr(api.main, "existing_gmail_service", lambda: service)
+    return service
+
+
+class TestGmailWebhook:
+    def test_cached_messages_are_not_fetched(self, gmail):
+        api.main.message_cache.put(MAILBOX, "cached-1", None)
+
+        response = TestClient(app).post("/gmail-webhook", json=_push(101))
+
+        assert response.json() == {"status": "received"}
+        gmail.users.return_value.messages.return_value.get.assert_not_called()
+        gmail.users.return_value.messages.return_value.list.assert_not_called()
+
+    def test_missing_token_never_starts_oauth_flow(self, gmail, monkeypatch, tmp_path):
+        monkeypatch.setattr(settings, "TOKEN_FILE", str(tmp_path / "missing-token.json"))
+        monkeypatch.setattr(api.main, "_credentials", None)
+        monkeypatch.setattr(api.main, "existing_gmail_service", existing_gmail_service)
+        monkeypatch.setattr(api.main, "_run_oauth_flow", MagicMock())
+
+        response = TestClient(app).post("/gmail-webhook", json=_push(101))
+
+        assert "No usable Gmail token" in response.json()["error"]
+        api.main._run_oauth_flow.assert_not_called()
+        assert load_history_id(MAILBOX) == "100"
+
+    def test_stale_history_id_is_skipped(self, gmail):
+        response = TestClient(app).post("/gmail-webhook", json=_push(100))
+
+        assert response.json() == {"status": "stale-history-id"}
+        gmail.users.return_value.history.assert_not_called()
+
+    def test_first_push_initializes_cursor(self, gmail, tmp_path):
+        (tmp_path / "last_history_id.txt").unlink()
+
+        response = TestClient(app).post("/gmail-webhook", json=_push(101))
+
+        assert response.json() == {"status": "initialized-history"}
+        assert load_history_id(MAILBOX) == "101"
+
+    def test_new_otp_is_signaled_and_cursor_advanced(self, gmail, monkeypatch):
+        get = gmail.users.return_value.messages.return_value.get
+        get.return_value.execute.side_effect = _message_responses("Your otp code is 4321")
+        signals = []
+
+        async def fake_signal(**kwargs):
+            signals.append(kwargs)
+            return _restate_response(200)
+
+        monkeypatch.setattr(api.main, "signal_workflow_with_otp", fake_signal)
+
+        response = TestClient(app).post("/gmail-webhook", json=_push(101))
+
+        assert response.json() == {"status": "received"}
+        assert signals == [{"platform": "zepto", "username": "store", "otp": "4321"}]
+        assert load_history_id(MAILBOX) == "101"
+
+    def test_failed_signal_keeps_cursor_for_retry(self, gmail, monkeypatch):
+        get = gmail.users.return_value.messages.return_value.get
+        get.return_value.execute.side_effect = _message_responses("Your otp code is 4321")
+
+        async def unavailable(**kwargs):
+            return _restate_response(503)
+
+        monkeypatch.setattr(api.main, "signal_workflow_with_otp", unavailable)
+
+        response = TestClient(app).post("/gmail-webhook", json=_push(101))
+
+        assert response.json() == {
+            "status": "signal-retry",
+            "signaled": 0,
+            "rejected": 0,
+            "retryable": 1,
+        }
+        assert load_history_id(MAILBOX) == "100"
+        assert api.main.message_cache.mark_signaled(MAILBOX, "cached-1")
+
+    @pytest.mark.parametrize("alice_status", [409, 503])
+    def test_failing_otp_does_not_block_later_ones(self, gmail, monkeypatch, alice_status):
+        gmail.users.return_value.history.return_value.list.return_value.execute.return_value = {
+            "history": [
+                {"messagesAdded": [{"message": {"id": "alice-1", "labelIds": ["INBOX"]}}]},
+                {"messagesAdded": [{"message": {"id": "bob-1", "labelIds": ["INBOX"]}}]},
+            ]
+        }
+        get = gmail.users.return_value.messages.return_value.get
+        get.return_value.execute.side_effect = _message_responses(
+            "Your otp code is 1111", to="alice@example.com"
+        ) + _message_responses("Your otp code is 2222", to="bob@example.com")
+        attempts = []
+
+        async def fake_signal(platform, username, otp):
+            attempts.append(username)
+            return _restate_response(alice_status if username == "alice" else 200)
+
+        monkeypatch.setattr(api.main, "signal_workflow_with_otp", fake_signal)
+        client = TestClient(app)
+
+        for history_id in (101, 102):
+            client.post("/gmail-webhook", json=_push(history_id))
+
+        if alice_status == 409:
+            # A rejected OTP counts as done: the cursor moves and nothing is retried
+            assert attempts == ["alice", "bob"]
+            assert load_history_id(MAILBOX) == "102"
+        else:
+            # Only the retryable OTP is retried; bob is never signaled twice
+            assert attempts == ["alice", "bob", "alice"]
+            assert load_history_id(MAILBOX) == "100"
+
+    def test_expired_cursor_recovers_gap(self, gmail):
+        history = gmail.users.return_value.history.return_value.list
+        history.return_value.execute.side_effect = HttpError(
+            httplib2.Response({"status": 404}), b"history expired"
+        )
+        listing = gmail.users.return_value.messages.return_value.list
+        listing.return_value.execute.return_value = {"messages": [{"id": "cached-1"}]}
+        api.main.message_cache.put(MAILBOX, "cached-1", None)
+
+        response = TestClient(app).post("/gmail-webhook", json=_push(101))
+
+        assert response.json() == {"status": "recovered-history", "messages": 1, "signaled": 0}
+        assert load_history_id(MAILBOX) == "101"
+
+
+class TestFetchParsedEmail:
+    def test_minimal_fetch_is_cached(self, monkeypatch):
+        monkeypatch.setattr(api.main, "message_cache", type(message_cache)(10, 60))
+        service = MagicMock()
+        get = service.users.return_value.messages.return_value.get
+        get.return_value.execute.side_effect = _message_responses("Your otp code is 2468")
+
+        first = fetch_parsed_email(service, "m1", mailbox=MAILBOX)
+        second = fetch_parsed_email(service, "m1", mailbox=MAILBOX)
+
+        assert first.otp == "2468"
+        assert first.message_id == "m1"
+        assert second is first
+        assert get.call_count == 2
+
+    def test_overlapping_fetches_share_one_download(self, monkeypatch):
+        monkeypatch.setattr(api.main, "message_cache", type(message_cache)(10, 60))
+        responses = iter(_message_responses("Your otp code is 2468"))
+        release = threading.Event()
+
+        def slow_execute():
+            release.wait(5)
+            return next(responses)
+
+        service = MagicMock()
+        get = service.users.return_value.messages.return_value.get
+        get.return_value.execute.side_effect = slow_execute
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            first = pool.submit(fetch_parsed_email, service, "m1", MAILBOX)
+            while ("m1" not in [k[1] for k in api.main._in_flight]) and not first.done():
+                time.sleep(0.01)
+            second = pool.submit(fetch_parsed_email, service, "m1", MAILBOX)
+            release.set()
+            results = [first.result(), second.result()]
+
+        assert [r.otp for r in results] == ["2468", "2468"]
+        assert get.call_count == 2
+
+    def test_raw_format(self, monkeypatch):
+        monkeypatch.setattr(api.main, "message_cache", type(message_cache)(10, 60))
+        monkeypatch.setattr(settings, "GMAIL_FETCH_FORMAT", "raw")
+        raw = (
+            f"Date: {formatdate(localtime=True)}\r\nFrom: otp@zepto.co\r\n"
+            "To: store@example.com\r\nContent-Type: text/html\r\n\r\n"
+            "<p>Your otp code is 1357</p>"
+        )
+        service = MagicMock()
+        get = service.users.return_value.messages.return_value.get
+        get.return_value.execute.return_value = {"raw": _b64(raw)}
+
+        assert fetch_parsed_email(service, "m1", mailbox=MAILBOX).otp == "1357"
+        assert get.call_args.kwargs["format"] == "raw"
+
+
+class TestWorkflowStatus:
+    @pytest.mark.parametrize(("status_code", "pending"), [(470, True), (200, False), (404, False)])
+    async def test_pending_only_while_running(self, monkeypatch, status_code, pending):
+        client = httpx.AsyncClient(
+            transport=httpx.MockTransport(lambda request: httpx.Response(status_code))
+        )
+        monkeypatch.setattr(api.main, "_workflow_client", client)
+
+        assert await workflow_is_pending("zepto", "store") is pending
+        await client.aclose()
+
+
+class TestLifecycle:
+    def test_startup_warms_up_and_reports_ready(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(settings, "TOKEN_FILE", str(tmp_path / "missing-token.json"))
+        monkeypatch.setattr(api.main, "_credentials", None)
+        monkeypatch.setattr(api.main, "_workflow_client", None)
+
+        with TestClient(app) as client:
+            assert client.get("/ready").json() == {"status": "ready"}
+            assert "hits" in client.get("/message-cache").json()
+
+    def test_ready_without_startup_warm_up(self, monkeypatch):
+        monkeypatch.setattr(settings, "WARM_UP_ON_STARTUP", False)
+        monkeypatch.setattr(settings, "WATCH_RENEWAL_ENABLED", False)
+        monkeypatch.setattr(api.main, "_ready", False)
+        monkeypatch.setattr(api.main, "_workflow_client", None)
+
+        with TestClient(app) as client:
+            assert client.get("/ready").json() == {"status": "ready"}
+
+
+class TestInboxMessageIds:
+    def test_keeps_inbox_messages_once(self):
+        history = [
+            {"messagesAdded": [{"message": {"id": "m1", "labelIds": ["INBOX", "UNREAD"]}}]},
+            {"messagesAdded": [{"message": {"id": "sent", "labelIds": ["SENT"]}}]},
+            {"messagesAdded": [{"message": {"id": "m1", "labelIds": ["INBOX"]}}]},
+            {"messagesDeleted": [{"message": {"id": "gone"}}]},
+        ]
+
+        assert inbox_message_ids(history) == ["m1"]
+
+
+class TestRenewWatchEndpoint:
+    @pytest.fixture
+    def watch_service(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(settings, "WATCH_STATE_FILE", str(tmp_path / "watch_state.json"))
+        service = MagicMock()
+        service.users.return_value.getProfile.return_value.execute.return_value = {
+            "emailAddress": MAILBOX
+        }
+        service.users.return_value.watch.return_value.execute.return_value = {
+            "historyId": "500",
+            "expiration": str(int((time.time() + 7 * 86400) * 1000)),
+        }
+        monkeypatch.setattr(api.main, "existing_gmail_service", lambda: service)
+        return service
+
+    def test_renews_missing_watch_once(self, watch_service):
+        client = TestClient(app)
+
+        assert client.post("/renew-watch").json()["status"] == "Watch renewed"
+        assert client.post("/renew-watch").json() == {"status": "Watch still valid"}
+        watch_service.users.return_value.watch.assert_called_once()
+
+    def test_failure_is_reported_to_the_scheduler(self, watch_service):
+        watch_service.users.return_value.watch.return_value.execute.side_effect = RuntimeError(
+            "quota"
+        )
+
+        response = TestClient(app).post("/renew-watch")
+
+        assert response.status_code == 500
+        assert response.json() == {"error": "quota"}